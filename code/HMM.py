@@ -1,19 +1,72 @@
+import argparse
+import json
+import numpy as np
+
 from collections import defaultdict
+from copy import copy
 from numpy.random import choice
+from scipy import sparse
+from scipy.sparse.linalg import spsolve
 
 # Start and end states
 START = None
 END = None
 
+# The number of strings a CompiledHMM samples at once
+DEFAULT_BATCH_SIZE = 100000
+
 """
 A set of classes that allows the definition of a Hidden Markov Model 
 to probabilistically generate a language corpus.
+
+HMMs can also be loaded from JSON files with load_hmm. The probabilities of
+their transitions and emissions can be numbers or linear terms in named
+parameters, such as a noise level (see probability).
 """
 
+def probability(term, parameters):
+    """
+    Returns the value of a probability given the values of the parameters
+    of an HMM.
+
+    term: Either a number, or a dict holding a linear term in the
+          parameters: {"const": c, "noise": a} stands for c + a * noise.
+          "const" is optional, and defaults to 0.
+    parameters: A dict of parameter values.
+    """
+    if not isinstance(term, dict):
+        return term
+    value = term.get('const', 0)
+    for name, coefficient in term.items():
+        if name == 'const':
+            continue
+        if name not in parameters:
+            raise ValueError(
+                "No value given for the HMM parameter '{}'".format(name)
+            )
+        value += coefficient * parameters[name]
+    return value
+
+def parse_parameter(arg):
+    """
+    Parses a parameter value given on the command line as NAME=VALUE,
+    returning a (name, value) tuple. Intended as an argparse type.
+    """
+    name, sep, value = arg.partition('=')
+    try:
+        if not (name and sep):
+            raise ValueError
+        return name, float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "'{}' is not a parameter value of the form NAME=VALUE".format(arg)
+        )
+
 class State():
     """
     A state in the HMM.
     """
+    __slots__ = ('num', 'label')
 
     def __init__(self, state_num, label=None):
         """
@@ -27,6 +80,8 @@ class Transition():
     """
     A transition in the HMM.
     """
+    __slots__ = ('start_state', 'end_state', 'emissions', 'probability')
+
     def __init__(self, start_state, end_state, emissions, probability):
         """
         start_state: A State object that is the starting state for this 
@@ -47,6 +102,8 @@ class Emission():
     """
     A class representing a string emitted when taking a transition.
     """
+    __slots__ = ('string', 'probability')
+
     def __init__(self, string, probability):
         """
         string: The string to emit.
@@ -60,7 +117,14 @@ class HMM():
     A class implementing a simple Hidden Markov Model.
     """
 
-    def __init__(self):
+    def __init__(self, name=None, parameters=None):
+        """
+        name: An optional name for the HMM.
+        parameters: A dict with the default values of the parameters that
+                    the probabilities of the HMM depend on, if any.
+        """
+        self.name = name
+        self.parameters = dict(parameters or {})
         self._states = {}
         self._transitions = defaultdict(list)
 
@@ -95,6 +159,14 @@ class HMM():
         )
         self._transitions[start_state].append(new_transition)
 
+    def compile(self, **parameters):
+        """
+        Returns a CompiledHMM, which samples strings from this HMM much more
+        quickly than generate_stringset. Keyword arguments override the
+        default values of the HMM's parameters.
+        """
+        return CompiledHMM(self, parameters)
+
     def generate_output(self):
         """
         Returns the output of generating a single string using the HMM.
@@ -110,16 +182,23 @@ class HMM():
             transition = self.get_next_element(next_transitions)
         return output
 
+    def generate_strings(self, n):
+        """
+        Yields strings generated by the HMM one at a time, so they never all
+        need to be held in memory.
+
+        n: The number of strings to generate.
+        """
+        for _ in range(n):
+            yield self.generate_output()
+
     def generate_stringset(self, n):
         """
         Generates a list of strings using the HMM.
 
         n: The number of strings to generate.
         """
-        stringset = []
-        for _ in range(n):
-            stringset.append(self.generate_output())
-        return stringset
+        return list(self.generate_strings(n))
 
     def get_next_element(self, elements):
         """
@@ -129,7 +208,9 @@ class HMM():
         elements: A list of elements to sample from. Elements can be any type,
                   but must have a 'probability' attribute.
         """
-        element_probabilities = [e.probability for e in elements]
+        element_probabilities = [
+            probability(e.probability, self.parameters) for e in elements
+        ]
         total_probability = sum(element_probabilities)
         if total_probability != 1:
             element_probabilities = list(map(
@@ -137,3 +218,361 @@ class HMM():
             ))
         next_element = choice(elements, p=element_probabilities)
         return next_element
+
+def cumulative_probabilities(probabilities):
+    """
+    Returns the cumulative sums of a list of probabilities, normalized so
+    that the last sum is exactly 1.
+    """
+    cumulative = np.cumsum(np.asarray(probabilities, dtype=float))
+    cumulative /= cumulative[-1]
+    cumulative[-1] = 1
+    return cumulative
+
+class CompiledHMM():
+    """
+    An HMM compiled into arrays, which samples many strings at once.
+
+    Each state has a row of cumulative transition probabilities, and each
+    transition a row of cumulative emission probabilities. Rows are padded
+    with 1s to a common length. Sampling from a row for many strings at once
+    then only needs one uniform random number per string, compared against
+    the whole row. The strings that are sampled follow the same distribution
+    as those from HMM.generate_stringset.
+
+    The probabilities are filled in separately from the structure of the
+    HMM, so an HMM whose probabilities depend on parameters only needs to
+    be compiled once: with_parameters returns a copy with new probabilities
+    that shares the rest of the arrays.
+    """
+    def __init__(self, hmm, parameters=None):
+        """
+        hmm: The HMM to compile. Later changes to it aren't reflected in the
+             compiled HMM.
+        parameters: A dict of parameter values, overriding the defaults of
+                    the HMM.
+        """
+        self.parameters = dict(hmm.parameters)
+        # Row 0 holds the transitions from the start state, and the END
+        # state is numbered after all the others.
+        self.states = [START] + [
+            state for state in hmm._states if state is not START
+        ]
+        for start_state, transitions in hmm._transitions.items():
+            for state in [start_state] + [t.end_state for t in transitions]:
+                if state is not END and state not in self.states:
+                    self.states.append(state)
+        state_idx = {state: i for i, state in enumerate(self.states)}
+        self.end = len(self.states)
+
+        state_transitions = [
+            hmm._transitions.get(state, []) for state in self.states
+        ]
+        # The transitions, numbered in order of their start states
+        self.transitions = [t for out in state_transitions for t in out]
+        if not self.transitions:
+            raise ValueError("The HMM has no transitions")
+        self.n_transitions = np.array([len(out) for out in state_transitions])
+        self.transition_ids = np.zeros(
+            (len(self.states), self.n_transitions.max()), dtype=int
+        )
+        first_id = 0
+        for i, out in enumerate(state_transitions):
+            self.transition_ids[i, :len(out)] = np.arange(
+                first_id, first_id + len(out)
+            )
+            first_id += len(out)
+        self.transition_targets = np.array([
+            self.end if t.end_state is END else state_idx[t.end_state]
+            for t in self.transitions
+        ])
+
+        # Empty emissions are given the symbol -1, and aren't output
+        self.symbols = []
+        symbol_idx = {}
+        max_emissions = max(len(t.emissions) for t in self.transitions)
+        self.emission_symbols = np.full(
+            (len(self.transitions), max_emissions), -1
+        )
+        for i, t in enumerate(self.transitions):
+            for j, e in enumerate(t.emissions):
+                if e.string:
+                    if e.string not in symbol_idx:
+                        symbol_idx[e.string] = len(self.symbols)
+                        self.symbols.append(e.string)
+                    self.emission_symbols[i, j] = symbol_idx[e.string]
+
+        # The names of the parameters that the probabilities depend on
+        terms = [t.probability for t in self.transitions] + [
+            e.probability for t in self.transitions for e in t.emissions
+        ]
+        self.parameter_names = set(self.parameters).union(*(
+            term.keys() - {'const'} for term in terms
+            if isinstance(term, dict)
+        ))
+
+        self.set_parameters(parameters or {})
+
+    def set_parameters(self, parameters):
+        """
+        Updates the values of the parameters of the HMM, and recomputes the
+        tables of cumulative probabilities from them. The tables are
+        replaced rather than modified, so copies of this CompiledHMM are
+        unaffected.
+        """
+        unknown = set(parameters) - self.parameter_names
+        if unknown:
+            raise ValueError(
+                "Unknown HMM parameters: {}. Available parameters are: "
+                "{}".format(', '.join(sorted(unknown)),
+                            ', '.join(sorted(self.parameter_names)))
+            )
+        self.parameters.update(parameters)
+
+        transition_cum = np.ones(self.transition_ids.shape)
+        for i, n in enumerate(self.n_transitions):
+            if n:
+                first = self.transition_ids[i, 0]
+                transition_cum[i, :n] = cumulative_probabilities([
+                    probability(t.probability, self.parameters)
+                    for t in self.transitions[first:first + n]
+                ])
+        self.transition_cum = transition_cum
+
+        emission_cum = np.ones(self.emission_symbols.shape)
+        for i, t in enumerate(self.transitions):
+            if t.emissions:
+                emission_cum[i, :len(t.emissions)] = cumulative_probabilities(
+                    [probability(e.probability, self.parameters)
+                     for e in t.emissions]
+                )
+        self.emission_cum = emission_cum
+
+    def with_parameters(self, **parameters):
+        """
+        Returns a copy of this CompiledHMM with new values for some of its
+        parameters. Only the tables of cumulative probabilities are
+        recomputed.
+        """
+        compiled = copy(self)
+        compiled.parameters = dict(self.parameters)
+        compiled.set_parameters(parameters)
+        return compiled
+
+    def sample_rows(self, cumulative, rng):
+        """
+        Samples one index from each row of a matrix of cumulative
+        probabilities.
+        """
+        u = rng.random(len(cumulative))
+        return (u[:, None] >= cumulative).sum(axis=1)
+
+    def sample_transitions(self, states, rng):
+        """
+        Samples the next transition for each of an array of state indices.
+        """
+        stuck = self.n_transitions[states] == 0
+        if stuck.any():
+            raise ValueError("State {} has no transitions".format(
+                self.states[states[stuck][0]]
+            ))
+        choices = self.sample_rows(self.transition_cum[states], rng)
+        return self.transition_ids[states, choices]
+
+    def generate_symbols(self, n, rng=None):
+        """
+        Generates n strings at once, advancing every unfinished string by one
+        transition at each step. Returns the strings as an array of
+        the number of symbols in each string and an array of all their
+        symbol ids, concatenated in order.
+
+        rng: A numpy Generator to sample with. A new, randomly seeded one is
+             used if this is None.
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+        active = np.arange(n)
+        transitions = self.sample_transitions(np.zeros(n, dtype=int), rng)
+        string_ids = []
+        symbol_ids = []
+        while len(active):
+            targets = self.transition_targets[transitions]
+            unfinished = targets != self.end
+            active = active[unfinished]
+            transitions = transitions[unfinished]
+            targets = targets[unfinished]
+
+            emissions = self.sample_rows(self.emission_cum[transitions], rng)
+            symbols = self.emission_symbols[transitions, emissions]
+            emitted = symbols >= 0
+            string_ids.append(active[emitted])
+            symbol_ids.append(symbols[emitted])
+
+            transitions = self.sample_transitions(targets, rng)
+
+        string_ids = np.concatenate(string_ids)
+        symbol_ids = np.concatenate(symbol_ids)
+        order = np.argsort(string_ids, kind='stable')
+        return np.bincount(string_ids, minlength=n), symbol_ids[order]
+
+    def generate_strings(self, n, rng=None, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Yields strings generated by the HMM, each of which is a list of
+        emitted symbols, as HMM.generate_strings does. The strings are
+        sampled batch_size at a time, so memory use depends on batch_size
+        rather than n.
+
+        n: The number of strings to generate.
+        rng: A numpy Generator to sample with. A new, randomly seeded one is
+             used if this is None. The strings generated from a given seed
+             also depend on batch_size.
+        batch_size: The number of strings to sample at once.
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+        for first in range(0, n, batch_size):
+            lengths, symbol_ids = self.generate_symbols(
+                min(batch_size, n - first), rng
+            )
+            symbols = [self.symbols[i] for i in symbol_ids.tolist()]
+            ends = np.cumsum(lengths).tolist()
+            starts = [0] + ends[:-1]
+            for start, end in zip(starts, ends):
+                yield symbols[start:end]
+
+    def generate_stringset(self, n, rng=None, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Generates a list of strings using the HMM, each of which is a list
+        of emitted symbols, as HMM.generate_stringset does. The arguments
+        are those of generate_strings.
+        """
+        return list(self.generate_strings(n, rng, batch_size))
+
+    def expected_ngram_counts(self, n, boundary=None):
+        """
+        Returns the expected number of times each n-gram occurs in a string
+        generated by the HMM, without sampling any strings. Each string is
+        padded with n-1 word boundaries on either side, as VectorModelBuilder
+        pads words, and only n-grams containing at least one symbol are
+        counted. Returns a dict mapping tuples of n symbols, with boundary
+        standing for a word boundary, to their expected counts.
+
+        The n-grams emitted next only depend on the current state and the
+        last n-1 symbols, so the HMM is expanded into a chain over the
+        (finitely many) reachable pairs of the two. The expected number of
+        visits to each pair follows from the forward equations of this
+        chain, which are solved exactly, and each n-gram is counted by the
+        expected number of times the transitions that emit it are taken.
+        """
+        # Boundaries are numbered after the symbols
+        pad = len(self.symbols)
+        transition_probs = np.diff(self.transition_cum, axis=1, prepend=0)
+        emission_probs = np.diff(self.emission_cum, axis=1, prepend=0)
+
+        # Every way of leaving each reachable (state, history) pair, as a
+        # (source, target, probability, n-grams emitted) tuple. Strings that
+        # end have a target of None.
+        start = (0, (pad,) * (n - 1))
+        node_idx = {start: 0}
+        nodes = [start]
+        edges = []
+        for source, (state, history) in enumerate(nodes):
+            for k in range(self.n_transitions[state]):
+                if transition_probs[state, k] == 0:
+                    continue
+                transition = self.transition_ids[state, k]
+                target = self.transition_targets[transition]
+                for j, symbol in enumerate(self.emission_symbols[transition]):
+                    prob = transition_probs[state, k] * emission_probs[
+                        transition, j
+                    ]
+                    if prob == 0:
+                        continue
+                    if symbol >= 0:
+                        ngrams = [history + (symbol,)]
+                        next_history = ngrams[0][1:]
+                    else:
+                        ngrams = []
+                        next_history = history
+                    if target == self.end:
+                        padded = next_history + (pad,) * (n - 1)
+                        ngrams.extend(
+                            padded[i:i + n] for i in range(n - 1)
+                            if any(s != pad for s in padded[i:i + n])
+                        )
+                        edges.append((source, None, prob, ngrams))
+                        continue
+                    node = (target, next_history)
+                    if node not in node_idx:
+                        node_idx[node] = len(nodes)
+                        nodes.append(node)
+                    edges.append((source, node_idx[node], prob, ngrams))
+
+        # The expected visits v solve v = e_start + P^T v
+        steps = [edge for edge in edges if edge[1] is not None]
+        forward = sparse.csc_matrix(
+            (
+                [prob for _, _, prob, _ in steps],
+                (
+                    [target for _, target, _, _ in steps],
+                    [source for source, _, _, _ in steps]
+                )
+            ),
+            shape=(len(nodes), len(nodes))
+        )
+        initial = np.zeros(len(nodes))
+        initial[0] = 1
+        identity = sparse.identity(len(nodes), format='csc')
+        visits = np.atleast_1d(spsolve(identity - forward, initial))
+        end_probability = sum(
+            visits[source] * prob for source, target, prob, _ in edges
+            if target is None
+        )
+        if not (np.all(np.isfinite(visits))
+                and np.isclose(end_probability, 1)):
+            raise ValueError(
+                "The HMM does not reach its end state with probability 1, so "
+                "its expected counts are undefined"
+            )
+
+        symbols = self.symbols + [boundary]
+        counts = defaultdict(float)
+        for source, _, prob, ngrams in edges:
+            for ngram in ngrams:
+                counts[tuple(symbols[s] for s in ngram)] += (
+                    visits[source] * prob
+                )
+        return dict(counts)
+
+def load_hmm(filename):
+    """
+    Loads an HMM from a JSON file, which has the following keys:
+
+    name: An optional name for the HMM.
+    parameters: An optional object mapping the names of the parameters that
+                probabilities depend on to their default values.
+    states: A list of objects with a unique integer "id" and an optional
+            "label".
+    transitions: A list of objects with keys "from" and "to", the ids of
+                 the start and end states (null for the start state and the
+                 end state respectively), "probability", and "emissions", a
+                 list of [string, probability] pairs.
+
+    Each probability can be a number or a linear term in the parameters (see
+    probability). The probabilities of the transitions from each state, and
+    of the emissions of each transition, are normalized when sampling, so
+    they can also be given as relative weights.
+    """
+    with open(filename, 'r') as f:
+        spec = json.load(f)
+
+    hmm = HMM(spec.get('name'), spec.get('parameters'))
+    for state in spec['states']:
+        hmm.add_state(state['id'], state.get('label'))
+    for transition in spec['transitions']:
+        hmm.add_transition(
+            transition['from'], transition['to'],
+            [tuple(emission) for emission in transition['emissions']],
+            transition['probability']
+        )
+    return hmm
@@ -1,9 +1,13 @@
 import argparse
-import nltk
 import numpy as np
+import vector_io
 
+from collections import Counter, defaultdict
+from itertools import chain, repeat
 from math import log
+from numpy.lib.stride_tricks import as_strided
 from os import path
+from scipy import sparse
 
 # Default files and directories
 DEFAULT_OUTDIR = "../vector_data/"
@@ -12,6 +16,13 @@ DEFAULT_N = 3
 # Counting methods
 NGRAM = 'ngram'
 
+# N-gram counting backends
+NUMPY = 'numpy'
+NLTK = 'nltk'
+
+# Key spaces up to this size are counted with np.bincount rather than np.unique
+MAX_BINCOUNT_SIZE = 2 ** 24
+
 # Weighting methods
 NONE = 'none'
 PMI = 'pmi'
@@ -21,14 +32,146 @@ CONDITIONAL_PROBABILITY = 'conditional_probability'
 
 WORD_BOUNDARY = "#"
 
+# Marks the names of models that count every occurrence of each word
+TOKENS = 'tokens'
+
+def count_name(count_method, n):
+    """
+    Returns the name of a counting method used in filenames, e.g. 'trigram'.
+    """
+    count_str = ""
+    if count_method == NGRAM:
+        if n == 1:
+            count_str = "unigram"
+        elif n == 2:
+            count_str = "bigram"
+        elif n == 3:
+            count_str = "trigram"
+        else:
+            count_str = "{}gram".format(n)
+    return count_str
+
+def model_name(dataset, count_method, n, weighting, count_tokens=False):
+    """
+    Returns the default base filename for the vector model of a dataset,
+    e.g. 'parupa_trigram_ppmi', or 'parupa_trigram_tokens_ppmi' if every
+    occurrence of each word is counted.
+    """
+    base_components = [path.splitext(path.split(dataset)[1])[0]]
+    base_components.append(count_name(count_method, n))
+    if count_tokens:
+        base_components.append(TOKENS)
+    base_components.append(weighting)
+    return '_'.join(base_components)
+
+def create_multi_n_builders(dataset, ns, **kwargs):
+    """
+    Creates a VectorModelBuilder for each value of n in ns and counts all of
+    them from a single pass over the dataset. The dataset is read,
+    deduplicated and encoded once, with enough word boundaries between
+    words for the largest n. Every n-gram containing a sound for a smaller
+    n occurs in this encoding exactly as it does with its own padding, and
+    the extra n-grams made up only of word boundaries are not counted.
+
+    kwargs are passed to each VectorModelBuilder. Returns the builders in
+    the order of ns, with their counts calculated, so create_vector_model
+    only needs to weight them.
+    """
+    builders = [VectorModelBuilder(dataset, n=n, **kwargs) for n in ns]
+    longest = max(builders, key=lambda builder: builder.n)
+    longest.build_symbols()
+    # Each builder drops the encoding once it has counted, so it's kept here
+    # until every builder has used it, whatever the order of ns.
+    encoded_corpus = longest.encode_corpus()
+    for builder in builders:
+        builder.share_encoding(longest)
+        builder.encoded_corpus = encoded_corpus
+        builder.build_matrix()
+    return builders
+
+class SymbolTable():
+    """
+    Interns hashable symbols, such as sounds or tuples of encoded sounds
+    representing contexts, as consecutive integer ids. Lookups in either
+    direction take constant time.
+    """
+    def __init__(self, symbols=()):
+        self._ids = {}
+        self._symbols = []
+        for symbol in symbols:
+            self.add(symbol)
+
+    def add(self, symbol):
+        """
+        Returns the id of the provided symbol, adding it to the table if it
+        hasn't been seen before.
+        """
+        symbol_id = self._ids.get(symbol)
+        if symbol_id is None:
+            symbol_id = len(self._symbols)
+            self._ids[symbol] = symbol_id
+            self._symbols.append(symbol)
+        return symbol_id
+
+    def index(self, symbol):
+        """
+        Returns the id of the provided symbol. Raises a KeyError if the symbol
+        is not in the table.
+        """
+        return self._ids[symbol]
+
+    def encode(self, symbols):
+        """
+        Converts a sequence of symbols into a list of their ids.
+        """
+        ids = self._ids
+        return [ids[symbol] for symbol in symbols]
+
+    def decode(self, symbol_ids):
+        """
+        Converts a sequence of ids into a list of their symbols.
+        """
+        symbols = self._symbols
+        return [symbols[symbol_id] for symbol_id in symbol_ids]
+
+    def __getitem__(self, symbol_id):
+        return self._symbols[symbol_id]
+
+    def __contains__(self, symbol):
+        return symbol in self._ids
+
+    def __iter__(self):
+        return iter(self._symbols)
+
+    def __len__(self):
+        return len(self._symbols)
+
 class VectorModelBuilder():
     """
     A class that takes in a dataset of words separated by newlines and 
     generates a vector embedding under the specified counting and
-    weighting methods. Requires nltk and numpy to be installed.
+    weighting methods. Requires numpy and scipy to be installed, and nltk if
+    the nltk n-gram backend is used.
+
+    If sparse is True, the count matrix and all weighted matrices are stored
+    as scipy.sparse CSR matrices rather than dense numpy arrays.
+
+    backend selects how n-grams are counted: 'numpy' uses a vectorized
+    kernel, while 'nltk' uses the original pure-Python implementation and
+    is mainly useful for verifying the former.
+
+    If count_tokens is True, every occurrence of a word in the dataset is
+    counted. By default, each distinct word is only counted once.
+
+    The raw counts are kept after weighting, so the same builder can produce
+    models under several weightings while only counting the dataset once
+    (see weight_matrix). They can also be saved with save_counts and loaded
+    into a new builder with load_counts, in which case the dataset is never
+    read.
     """
     def __init__(self, dataset, count_method=NGRAM,
-                 weighting=PPMI, outdir=DEFAULT_OUTDIR, outfile=None, n=3):
+                 weighting=PPMI, outdir=DEFAULT_OUTDIR, outfile=None, n=3,
+                 sparse=False, backend=NUMPY, count_tokens=False):
         self.count_method = count_method
         if n < 1:
             raise ValueError("n = {} is not valid. n must be > 0.".format(n))
@@ -36,11 +179,22 @@ class VectorModelBuilder():
         self.outfile = outfile
         self.outdir = outdir
         self.weighting = weighting
+        self.sparse = sparse
+        self.backend = backend
+        self.count_tokens = count_tokens
 
         self.sound_idx = []
         self.context_idx = []
+        self.symbols = SymbolTable()
+        self.contexts = SymbolTable()
+        self.boundary_id = None
+        self.word_lengths = None
+        self.word_sounds = None
+        self.word_counts = None
+        self.encoded_corpus = None
+        self.count_matrix = None
         self.matrix = None
-        
+
         self.weighting_functions = {
             PROBABILITY: self.matrix_to_probability,
             CONDITIONAL_PROBABILITY: self.matrix_to_conditional_probability,
@@ -52,27 +206,75 @@ class VectorModelBuilder():
         self.counting_functions = {
             NGRAM: self.count_ngrams
         }
+        self.ngram_backends = {
+            NUMPY: self.count_ngrams_numpy,
+            NLTK: self.count_ngrams_nltk
+        }
 
-        self.preprocess_dataset(dataset)
+        self.dataset = dataset
 
     def preprocess_dataset(self, dataset):
         """
-        Loads, removes duplicate words, and tokenizes the provided dataset.
+        Loads the provided dataset, removes duplicate words and builds the
+        symbol table of its sounds. The file is read one line at a time, and
+        each line is counted by its hash as it is read, so only one copy of
+        each distinct word is held in memory.
+
+        The distinct words are then stored as flat integer arrays:
+        word_lengths holds the number of sounds in each word, word_sounds
+        the ids of the sounds of every word, concatenated in order, and
+        word_counts the number of times each word occurs in the dataset.
         """
         self.dataset = dataset
+        word_counts = Counter()
         with open(self.dataset, 'r') as f:
-            tokens = f.read()
-        self.tokens = set([tuple(s.split(" ")) for s in tokens.split("\n") if s])
-        self.tokens = [list(token) for token in self.tokens]
+            word_counts.update(f)
+        # Lines are kept with their line endings, and only the last line of
+        # the file can lack one.
+        for line in [line for line in word_counts if line[-1:] != "\n"]:
+            word_counts[line + "\n"] += word_counts.pop(line)
+        word_counts.pop("\n", None)
+
+        # Sounds are numbered in the order they are first seen, and then
+        # renumbered in sorted order once they are all known.
+        seen = SymbolTable()
+        self.word_lengths = np.fromiter(
+            (word.count(" ") + 1 for word in word_counts), dtype=np.int64,
+            count=len(word_counts)
+        )
+        seen_ids = np.fromiter(
+            chain.from_iterable(
+                map(seen.add, word[:-1].split(" ")) for word in word_counts
+            ),
+            dtype=np.int32, count=self.word_lengths.sum()
+        )
+        self.word_counts = np.fromiter(
+            word_counts.values(), dtype=np.int64, count=len(word_counts)
+        )
+
+        self.sound_idx = sorted(seen)
+        # Sounds are encoded as their row in the matrix, followed by the
+        # word boundary symbol.
+        self.symbols = SymbolTable(self.sound_idx)
+        self.boundary_id = self.symbols.add(WORD_BOUNDARY)
+        renumbered = np.array(self.symbols.encode(seen), dtype=np.int32)
+        self.word_sounds = renumbered[seen_ids]
+
+    def encoded_words(self):
+        """
+        Yields each distinct word in the dataset as a list of sound ids.
+        """
+        ends = np.cumsum(self.word_lengths)
+        starts = ends - self.word_lengths
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            yield self.word_sounds[start:end].tolist()
 
     def build_matrix(self):
         """
         Generates the matrix representing counts of sounds in contexts.
         """
-        unique_sounds = set(
-            [item for sublist in self.tokens for item in sublist]
-        )
-        self.sound_idx = sorted(list(unique_sounds))
+        if self.boundary_id is None:
+            self.build_symbols()
         count_function = self.counting_functions.get(self.count_method)
         if not count_function:
             raise ValueError(
@@ -82,58 +284,251 @@ class VectorModelBuilder():
                 )
             )
         else:
-            position_lists = count_function()
-            self.create_count_matrix(position_lists)
+            position_counts = count_function()
+            self.create_count_matrix(position_counts)
+            # The encoded corpus is only needed for counting
+            self.encoded_corpus = None
+
+    def build_symbols(self):
+        """
+        Loads the dataset if necessary, which builds the symbol table of its
+        sounds.
+        """
+        if self.word_lengths is None:
+            self.preprocess_dataset(self.dataset)
+
+    def share_encoding(self, builder):
+        """
+        Reuses the words, symbol table and encoded corpus of another builder
+        for the same dataset, rather than loading and encoding it again. The
+        other builder's corpus must be padded for an n at least as large as
+        this builder's.
+        """
+        self.word_lengths = builder.word_lengths
+        self.word_sounds = builder.word_sounds
+        self.word_counts = builder.word_counts
+        self.sound_idx = builder.sound_idx
+        self.symbols = builder.symbols
+        self.boundary_id = builder.boundary_id
+        self.encoded_corpus = builder.encoded_corpus
 
     def count_ngrams(self):
         """
-        Creates a list of all n-grams in the corpus.
+        Counts how often each sound occurs in each n-gram context in the
+        corpus using the selected backend.
+
+        Returns, for each position of the target sound in the n-gram, a
+        tuple (contexts, targets, counts) of aligned arrays: contexts is a
+        2D array with one encoded context of n-1 sounds per row, targets
+        holds the id of the sound in that context, and counts how often it
+        occurs there. Rows are sorted by context and then by target.
         """
-        ngrams = [
-            x for token in self.tokens
-            for x in nltk.ngrams(
-                [WORD_BOUNDARY] * (self.n - 1) + token + [WORD_BOUNDARY] * (self.n - 1),
-                self.n
+        backend_function = self.ngram_backends.get(self.backend)
+        if not backend_function:
+            raise ValueError(
+                "'{}' is not a valid n-gram backend. "
+                "Available backends are: {}".format(
+                    self.backend, ','.join(self.ngram_backends.keys())
+                )
             )
-        ]
+        return backend_function()
+
+    def encode_corpus(self):
+        """
+        Encodes the corpus as a single array of symbol ids. Each word is
+        preceded by n-1 word boundaries and the last word is followed by
+        n-1 word boundaries. Because words are separated by n-1 boundaries,
+        every n-gram in the array containing a sound belongs to exactly one
+        padded word. The same holds for any smaller n.
+        """
+        padding = self.n - 1
+        num_words = len(self.word_lengths)
+        corpus = np.full(
+            len(self.word_sounds) + padding * (num_words + 1),
+            self.boundary_id, dtype=np.int64
+        )
+        # Each sound is shifted by the padding before its word and every
+        # word before it.
+        word_ids = np.repeat(np.arange(num_words), self.word_lengths)
+        corpus[np.arange(len(self.word_sounds)) + padding * (word_ids + 1)] = (
+            self.word_sounds
+        )
+        return corpus
 
-        position_lists = [[] for i in range(self.n)]
+    def token_weights(self, corpus):
+        """
+        Returns the number of times the word that each position of an
+        encoded corpus belongs to occurs in the dataset, and 0 for the
+        padding before the first word. The corpus can be padded for any n.
+        """
+        num_words = len(self.word_lengths)
+        padding = (len(corpus) - len(self.word_sounds)) // (num_words + 1)
+        return np.concatenate([
+            np.zeros(padding, dtype=np.int64),
+            np.repeat(self.word_counts, self.word_lengths + padding)
+        ])
 
-        for gram in ngrams:
-            for index, target in enumerate(gram):
-                if target != WORD_BOUNDARY:
-                    context = gram[:index] + gram[index+1:]
-                    position_lists[index].append((context, target))
+    def count_ngrams_numpy(self):
+        """
+        Counts n-grams with numpy. Contexts are encoded as mixed-radix
+        integers over the symbol table, and each (context, sound) pair is
+        then counted as a single integer key. A corpus already encoded for
+        this or a larger n is reused if available. If count_tokens is True,
+        each n-gram is weighted by the frequency of the word it occurs in.
+        """
+        corpus = self.encoded_corpus
+        if corpus is None:
+            corpus = self.encode_corpus()
+        weights = None
+        if self.count_tokens:
+            weights = self.token_weights(corpus)
+        radix = len(self.symbols)
+        num_sounds = len(self.sound_idx)
+        key_space = radix ** (self.n - 1) * num_sounds
+        if key_space > np.iinfo(np.int64).max:
+            raise ValueError(
+                "n = {} is too large to encode with the numpy backend. "
+                "Use the nltk backend instead.".format(self.n)
+            )
 
-        return [position_lists]
+        # A read-only view of every n-gram in the corpus, one per row
+        num_windows = max(len(corpus) - self.n + 1, 0)
+        windows = as_strided(
+            corpus, shape=(num_windows, self.n),
+            strides=(corpus.strides[0], corpus.strides[0]), writeable=False
+        )
 
-    def create_count_matrix(self, position_lists):
+        position_counts = []
+        for index in range(self.n):
+            targets = windows[:, index]
+            has_target = targets != self.boundary_id
+
+            keys = np.zeros(np.count_nonzero(has_target), dtype=np.int64)
+            for j in range(self.n):
+                if j != index:
+                    keys = keys * radix + windows[has_target, j]
+            keys = keys * num_sounds + targets[has_target]
+            key_weights = None
+            if weights is not None:
+                # Each target sound belongs to the word the n-gram occurs in
+                key_weights = weights[index:index + num_windows][has_target]
+
+            if key_space <= max(MAX_BINCOUNT_SIZE, len(keys)):
+                key_counts = np.bincount(keys, key_weights)
+                keys = np.flatnonzero(key_counts)
+                counts = key_counts[keys]
+            elif key_weights is None:
+                keys, counts = np.unique(keys, return_counts=True)
+            else:
+                keys, key_ids = np.unique(keys, return_inverse=True)
+                counts = np.bincount(key_ids, key_weights)
+
+            codes, targets = np.divmod(keys, num_sounds)
+            contexts = np.zeros((len(codes), self.n - 1), dtype=np.int64)
+            for j in reversed(range(self.n - 1)):
+                codes, contexts[:, j] = np.divmod(codes, radix)
+            position_counts.append((contexts, targets, counts))
+
+        return [position_counts]
+
+    def count_ngrams_nltk(self):
         """
-        Calculates the conditional frequencies of each sound in the 
-        provided list of n-gram tokens.
+        Counts n-grams with nltk. N-grams are generated one word at a time
+        and counted immediately, so the full list of n-grams is never built.
         """
-        conditional_freqs = [
-            [nltk.ConditionalFreqDist(l2) for l2 in l1] 
-            for l1 in position_lists
-        ]
+        import nltk
+
+        padding = [self.boundary_id] * (self.n - 1)
+        position_freqs = [defaultdict(Counter) for i in range(self.n)]
+        if self.count_tokens:
+            word_counts = self.word_counts.tolist()
+        else:
+            word_counts = repeat(1)
+
+        for word, word_count in zip(self.encoded_words(), word_counts):
+            for gram in nltk.ngrams(padding + word + padding, self.n):
+                for index, target in enumerate(gram):
+                    if target != self.boundary_id:
+                        context = gram[:index] + gram[index+1:]
+                        position_freqs[index][context][target] += word_count
 
-        vec_len = sum(len(l) for c in conditional_freqs for l in c)
+        position_counts = []
+        for freqs in position_freqs:
+            cells = sorted(
+                (context, target, count)
+                for context, targets in freqs.items()
+                for target, count in targets.items()
+            )
+            position_counts.append((
+                np.array(
+                    [context for context, _, _ in cells], dtype=np.int64
+                ).reshape(len(cells), self.n - 1),
+                np.array([target for _, target, _ in cells], dtype=np.int64),
+                np.array([count for _, _, count in cells], dtype=np.int64)
+            ))
+
+        return [position_counts]
+
+    def create_count_matrix(self, position_counts):
+        """
+        Builds the matrix of counts of each sound in each context from the
+        (contexts, targets, counts) arrays returned by a counting function.
+        """
         num_sounds = len(self.sound_idx)
-        self.matrix = np.zeros((num_sounds, vec_len))
-        self.context_idx = []
+        # Contexts are interned as (target position, encoded context) pairs,
+        # with ids giving their column in the matrix.
+        self.contexts = SymbolTable()
+        rows = []
+        cols = []
+        counts = []
+
+        for sublist in position_counts:
+            for i, (contexts, targets, context_counts) in enumerate(sublist):
+                if not len(targets):
+                    continue
+                # Rows are sorted by context, so a new column starts
+                # wherever the context differs from the previous row.
+                new_context = np.ones(len(targets), dtype=bool)
+                new_context[1:] = np.any(contexts[1:] != contexts[:-1], axis=1)
+                offset = len(self.contexts)
+                for context in contexts[new_context].tolist():
+                    self.contexts.add((i, tuple(context)))
+
+                rows.append(targets)
+                cols.append(np.cumsum(new_context) - 1 + offset)
+                counts.append(context_counts)
+
+        self.context_idx = [
+            self.context_label(i, context) for i, context in self.contexts
+        ]
+        self.count_matrix = self.format_matrix(sparse.coo_matrix(
+            (
+                np.concatenate(counts).astype(float) if counts else [],
+                (
+                    np.concatenate(rows) if rows else [],
+                    np.concatenate(cols) if cols else []
+                )
+            ),
+            shape=(num_sounds, len(self.contexts))
+        ))
 
-        for sublist in conditional_freqs:
-            for i, position_freqs in enumerate(sublist):
-                for key, value in position_freqs.items():
-                    context = list(key)
-                    context.insert(i, '_')
-                    context_label = '-'.join(context)
-                    self.context_idx.append(context_label)
+    def context_label(self, position, context):
+        """
+        Builds the human-readable label of an encoded context, with an
+        underscore marking the position of the target sound, e.g. 'a-_-#'.
+        """
+        context = self.symbols.decode(context)
+        context.insert(position, '_')
+        return '-'.join(context)
 
-                    for sound, count in value.items():
-                        row = self.sound_idx.index(sound)
-                        col = len(self.context_idx) - 1
-                        self.matrix[row][col] = count
+    def format_matrix(self, matrix):
+        """
+        Converts a scipy.sparse matrix into the representation used by this
+        builder: CSR if sparse is True, and a dense numpy array otherwise.
+        """
+        if self.sparse:
+            return matrix.tocsr()
+        return matrix.toarray()
 
     def matrix_to_PPMI(self):
         """
@@ -145,104 +540,194 @@ class VectorModelBuilder():
         """
         Weights the matrix of counts using either PMI or PPMI.
         """
-        weighted_matrix = np.zeros(self.matrix.shape)
         denominator = self.matrix.sum()
 
         # This is calculated a bit differently than in the paper. Rather than
         # calculating P(s, c) and then using it to calculate P(s) and P(c),
-        # I calculate all three directly from the count matrix.
-        for i in range(self.matrix.shape[0]):
-            # P(s)
-            p_i = self.matrix[i].sum() / denominator
-            for j in range(self.matrix.shape[1]):
-                # P(c)
-                p_j = self.matrix[:, j].sum() / denominator
-                # P(s,c)
-                p_ij = self.matrix[i][j] / denominator
-                if not p_i or not p_j or not p_ij:
-                    mi = 0
-                else:
-                    mi = log(p_ij / (p_i * p_j), 2)
-                weighted_matrix[i][j] = max(mi, 0) if ppmi else mi
-        self.matrix = weighted_matrix
+        # I calculate all three directly from the count matrix. The row and
+        # column marginals are computed once and broadcast over the matrix.
+        # P(s)
+        p_i = np.asarray(self.matrix.sum(axis=1)).ravel() / denominator
+        # P(c)
+        p_j = np.asarray(self.matrix.sum(axis=0)).ravel() / denominator
+
+        # Cells with a count of 0 are weighted as 0, so only the nonzero
+        # cells need to be computed. This also preserves sparsity.
+        counts = sparse.coo_matrix(self.matrix)
+        # P(s,c)
+        p_ij = counts.data / denominator
+        mi = np.log(p_ij / (p_i[counts.row] * p_j[counts.col])) / log(2)
+        if ppmi:
+            np.maximum(mi, 0, out=mi)
+
+        weighted_matrix = sparse.coo_matrix(
+            (mi, (counts.row, counts.col)), shape=counts.shape
+        )
+        weighted_matrix.eliminate_zeros()
+        self.matrix = self.format_matrix(weighted_matrix)
 
     def matrix_to_conditional_probability(self):
         """
         Weights the matrix of counts using conditional probability.
         """
-        weighted_matrix = np.zeros(self.matrix.shape)
-        for i in range(self.matrix.shape[1]):
-            col_sum = self.matrix[:, i].sum()
-            for j in range(self.matrix.shape[0]):
-                weighted_matrix[j, i] = self.matrix[j, i] / col_sum
-        self.matrix = weighted_matrix
+        col_sums = np.asarray(self.matrix.sum(axis=0)).ravel()
+        if self.sparse:
+            # The column indices of the stored CSR values
+            weighted_matrix = self.matrix.copy()
+            weighted_matrix.data /= col_sums[weighted_matrix.indices]
+            self.matrix = weighted_matrix
+        else:
+            self.matrix = self.matrix / col_sums
 
     def matrix_to_probability(self):
         """
         Weights the matrix of counts using probability.
         """
-        weighted_matrix = np.zeros(self.matrix.shape)
         total_count = self.matrix.sum()
-        for i in range(self.matrix.shape[0]):
-            for j in range(self.matrix.shape[1]):
-                weighted_matrix[i, j] = self.matrix[i, j] / total_count
-        self.matrix = weighted_matrix
+        if self.sparse:
+            weighted_matrix = self.matrix.copy()
+            weighted_matrix.data /= total_count
+            self.matrix = weighted_matrix
+        else:
+            self.matrix = self.matrix / total_count
 
     def create_vector_model(self):
         """
         Top-level function that counts sound occurrences and weights them
-        using the specified methods.
+        using the specified methods. The dataset is only counted if no counts
+        have been calculated or loaded yet.
         """
         print("Generating vector embedding for {}...".format(self.dataset))
-        self.build_matrix()
-        weighting_function = self.weighting_functions.get(self.weighting)
+        if self.count_matrix is None:
+            self.build_matrix()
+        self.weight_matrix(self.weighting)
+
+    def weight_matrix(self, weighting):
+        """
+        Weights the raw counts using the provided weighting method, replacing
+        any previously weighted matrix. The counts themselves are unchanged,
+        so this can be called repeatedly to derive several weighted models.
+        """
+        weighting_function = self.weighting_functions.get(weighting)
         if not weighting_function:
             raise ValueError(
                 "'{}' is not a valid weighting function. "
-                "Available counting methods are: {}".format(
-                    self.count_method, ','.join(self.weighting_functions.keys())
+                "Available weighting methods are: {}".format(
+                    weighting, ','.join(self.weighting_functions.keys())
                 )
             )
         else:
+            self.weighting = weighting
+            self.matrix = self.count_matrix
             weighting_function()
 
-    def save_vector_model(self):
+    def save_counts(self, fmt=vector_io.BINARY):
+        """
+        Saves the raw counts under the name that a model with the 'none'
+        weighting would be saved under, with '_none' appended if outfile is
+        set. The saved counts can be reloaded with load_counts.
+        """
+        if self.count_matrix is None:
+            self.build_matrix()
+        if not self.outfile:
+            base_str = model_name(
+                self.dataset, self.count_method, self.n, NONE,
+                self.count_tokens
+            )
+        else:
+            base_str = '{}_{}'.format(self.outfile, NONE)
+
+        vector_io.save_vector_model(
+            path.join(self.outdir, base_str), self.count_matrix,
+            self.sound_idx, self.context_idx, fmt
+        )
+
+    def load_counts(self, counts_stem):
+        """
+        Loads raw counts saved by save_counts (or any model saved with the
+        'none' weighting) in place of counting the dataset.
+        """
+        matrix, self.sound_idx, self.context_idx = vector_io.load_vector_model(
+            counts_stem, mmap=False
+        )
+        self.count_matrix = self.format_matrix(sparse.coo_matrix(matrix))
+
+    def count_hmm(self, hmm):
+        """
+        Calculates the expected counts of the n-grams in a string generated
+        by an HMM in place of counting the dataset, so no corpus needs to be
+        sampled or read. Only n-gram counting is supported.
+
+        hmm: A CompiledHMM (see HMM.py).
+
+        The counts are the expected number of times each sound occurs in
+        each context in a single string, so the counts of a corpus of
+        sampled strings approach them in proportion to its size if
+        count_tokens is True. They don't depend on which words happen to be
+        sampled, which makes them a noise-free reference for models of
+        sampled corpora. All weighting methods other than 'none' are
+        unaffected by the scale of the counts.
+        """
+        if self.count_method != NGRAM:
+            raise ValueError(
+                "Expected counts can only be calculated with the '{}' "
+                "counting method".format(NGRAM)
+            )
+        ngram_counts = hmm.expected_ngram_counts(self.n, WORD_BOUNDARY)
+        self.sound_idx = sorted(set(
+            sound for ngram in ngram_counts for sound in ngram
+            if sound != WORD_BOUNDARY
+        ))
+        self.symbols = SymbolTable(self.sound_idx)
+        self.boundary_id = self.symbols.add(WORD_BOUNDARY)
+
+        position_counts = []
+        for index in range(self.n):
+            cells = sorted(
+                (
+                    self.symbols.encode(ngram[:index] + ngram[index+1:]),
+                    self.symbols.index(ngram[index]), count
+                )
+                for ngram, count in ngram_counts.items()
+                if ngram[index] != WORD_BOUNDARY
+            )
+            position_counts.append((
+                np.array(
+                    [context for context, _, _ in cells], dtype=np.int64
+                ).reshape(len(cells), self.n - 1),
+                np.array([target for _, target, _ in cells], dtype=np.int64),
+                np.array([count for _, _, count in cells], dtype=float)
+            ))
+        self.create_count_matrix([position_counts])
+
+    def save_vector_model(self, fmt=vector_io.BINARY):
         """
-        Saves the generated vector embedding to three text files. The .data
-        file contains the numeric vectors, the .sounds file contains the sound
-        labels (row names) and the .contexts file contains the context names
-        (column names).
+        Saves the generated vector embedding to three files. The .sounds
+        file contains the sound labels (row names) and the .contexts file
+        contains the context names (column names). The numeric vectors are
+        saved to a binary .npy file (.npz if the matrix is sparse) if fmt is
+        'binary', or to a .data text file if fmt is 'text'.
         """
         if not self.outfile:
-            base_components = [path.splitext(path.split(self.dataset)[1])[0]]
-            count_str = ""
-            if self.count_method == NGRAM:
-                if self.n == 1:
-                    count_str = "unigram"
-                elif self.n == 2:
-                    count_str = "bigram"
-                elif self.n == 3:
-                    count_str = "trigram"
-                else:
-                    count_str = "{}gram".format(self.n)
-            base_components.append(count_str)
-            base_components.append(self.weighting)
-            base_str = '_'.join(base_components)
+            base_str = model_name(
+                self.dataset, self.count_method, self.n, self.weighting,
+                self.count_tokens
+            )
         else:
             base_str = self.outfile
 
-        np.savetxt(path.join(
-            self.outdir, '{}.data'.format(base_str)), self.matrix, fmt='%f'
+        vector_io.save_vector_model(
+            path.join(self.outdir, base_str), self.matrix, self.sound_idx,
+            self.context_idx, fmt
         )
-        with open(path.join(self.outdir, '{}.sounds'.format(base_str)), 'w') as f:
-            print(' '.join(self.sound_idx), file=f)
-        with open(path.join(self.outdir, '{}.contexts'.format(base_str)), 'w') as f:
-            print(' '.join(self.context_idx), file=f)
 
 if __name__ == "__main__":
     """
     Code for generating a vector embedding from the command line.
     """
+    # Only needed for --hmm, so importing the builder doesn't load it
+    from HMM import load_hmm, parse_parameter
+
     parser = argparse.ArgumentParser(
         description="Create a vector space embedding of segments in a "
                     "phonological data set."
@@ -256,26 +741,98 @@ if __name__ == "__main__":
              'method currently supported is "ngram".'
     )
     parser.add_argument(
-        '--n', default=DEFAULT_N, type=int,
-        help='If count_method is "ngram", this specifies n.'
+        '--n', default=[DEFAULT_N], type=int, nargs='+',
+        help='If count_method is "ngram", this specifies n. Several values '
+             'can be given, separated by spaces, to save a model for each of '
+             'them from a single pass over the dataset.'
     )
     parser.add_argument(
-        '--weighting', default=PPMI, type=str,
-        help='The method to weight the raw counts'
+        '--weighting', default=[PPMI], type=str, nargs='+',
+        help='The method to weight the raw counts. Several methods can be '
+             'given, separated by spaces, to save a model for each of them '
+             'while only counting the dataset once.'
     )
     parser.add_argument(
         '--outfile', type=str, default=None,
-        help='The filename to save the vector model under.'
+        help='The filename to save the vector model under. If several '
+             'values of n or weighting methods are given, their names are '
+             'appended to it.'
     )
     parser.add_argument(
         '--outdir', type=str, default=DEFAULT_OUTDIR,
         help='The directory to save the vector data in.'
     )
+    parser.add_argument(
+        '--sparse', action='store_true',
+        help='Store the count and weighted matrices as sparse matrices.'
+    )
+    parser.add_argument(
+        '--backend', type=str, default=NUMPY,
+        help='The implementation used to count n-grams: "numpy" (the '
+             'default) or "nltk", which is slower but useful for '
+             'verification.'
+    )
+    parser.add_argument(
+        '--format', type=str, default=vector_io.BINARY,
+        help='The format to save the vectors in: "binary" (the default) '
+             'saves them to a .npy file, or a .npz file if --sparse is set, '
+             'and "text" saves them to a .data text file.'
+    )
+    parser.add_argument(
+        '--count_tokens', action='store_true',
+        help='Count every occurrence of each word in the dataset, rather '
+             'than each distinct word once.'
+    )
+    parser.add_argument(
+        '--counts', type=str, default=None,
+        help='The stem of a vector model saved with the "none" weighting. '
+             'Its raw counts are weighted instead of counting the dataset, '
+             'which is then only used to name the output files.'
+    )
+    parser.add_argument(
+        '--hmm', type=str, default=None,
+        help='A JSON file specifying an HMM (see HMM.load_hmm). The expected '
+             'counts of the strings it generates are weighted instead of '
+             'counting the dataset, which is then only used to name the '
+             'output files.'
+    )
+    parser.add_argument(
+        '--hmm_parameters', type=parse_parameter, nargs='+', default=[],
+        metavar='NAME=VALUE',
+        help='Values of the parameters of the HMM given by --hmm, such as '
+             'noise=0.25.'
+    )
 
     args = parser.parse_args()
-    builder = VectorModelBuilder(
-        args.dataset, args.count_method, args.weighting, args.outdir,
-        args.outfile, args.n
+    builder_args = dict(
+        count_method=args.count_method, weighting=args.weighting[0],
+        outdir=args.outdir, outfile=args.outfile, sparse=args.sparse,
+        backend=args.backend, count_tokens=args.count_tokens
     )
-    builder.create_vector_model()
-    builder.save_vector_model()
+    if args.counts:
+        if len(args.n) > 1:
+            parser.error('--counts can only be used with a single value of --n')
+        builders = [VectorModelBuilder(args.dataset, n=args.n[0], **builder_args)]
+        builders[0].load_counts(args.counts)
+    elif args.hmm:
+        hmm = load_hmm(args.hmm).compile(**dict(args.hmm_parameters))
+        builders = []
+        for n in args.n:
+            builder = VectorModelBuilder(args.dataset, n=n, **builder_args)
+            builder.count_hmm(hmm)
+            builders.append(builder)
+    else:
+        builders = create_multi_n_builders(args.dataset, args.n, **builder_args)
+
+    for builder in builders:
+        for weighting in args.weighting:
+            if args.outfile:
+                outfile = [args.outfile]
+                if len(args.n) > 1:
+                    outfile.append(count_name(args.count_method, builder.n))
+                if len(args.weighting) > 1:
+                    outfile.append(weighting)
+                builder.outfile = '_'.join(outfile)
+            builder.weighting = weighting
+            builder.create_vector_model()
+            builder.save_vector_model(args.format)
@@ -0,0 +1,40 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from os import cpu_count
+
+'''
+Helpers shared by the scripts that process a batch of corpora or vector
+models, each item in its own process if more than one job is requested.
+'''
+
+def process_count(jobs):
+    '''
+    Returns the number of processes to use for a --jobs value, where 0 means
+    one process per CPU.
+    '''
+    return jobs or cpu_count()
+
+def run_batch(function, items, args=(), jobs=1):
+    '''
+    Calls function(item, *args) for each of the provided items, using a pool
+    of jobs processes if jobs > 1 (0 uses one process per CPU). Yields an
+    (item, result, error) tuple for each item as it finishes, where error is
+    None if the call succeeded and the exception it raised otherwise, so one
+    failed item doesn't stop the rest of the batch.
+    '''
+    jobs = process_count(jobs)
+    if jobs == 1:
+        for item in items:
+            try:
+                yield item, function(item, *args), None
+            except Exception as e:
+                yield item, None, e
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {
+                executor.submit(function, item, *args): item for item in items
+            }
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result(), None
+                except Exception as e:
+                    yield futures[future], None, e
@@ -0,0 +1,566 @@
+import argparse
+import clusterer
+import gc
+import json
+import numpy as np
+import platform
+import scipy
+import sklearn
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import vector_io
+
+from HMM import load_hmm
+from VectorModelBuilder import (
+    CONDITIONAL_PROBABILITY, NGRAM, NONE, PMI, PPMI, PROBABILITY,
+    VectorModelBuilder
+)
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime, timezone
+from generate_parupa_corpora import DEFAULT_SPEC, generate_corpus
+from os import cpu_count, devnull, path, replace
+from types import SimpleNamespace
+
+'''
+Benchmarks the steps of the pipeline from corpus to classes: building
+vector models, saving them, clustering them and computing BICs, as well as
+generating corpora from an HMM. Each benchmark is run on the shipped corpora
+and on larger synthetic Parupa corpora, and the wall time, peak memory and
+throughput of each are saved to a JSON file, so that the results of
+different commits can be compared.
+'''
+
+DEFAULT_CORPUS_DIR = '../corpora/'
+DEFAULT_OUTPUT = 'benchmark_results.json'
+DEFAULT_REPEAT = 3
+DEFAULT_SEED = 0
+
+# The shipped corpora that are benchmarked, as (name, path relative to the
+# corpus directory). noisy_parupa is represented by three noise levels.
+CORPORA = [
+    ('english', 'english.txt'),
+    ('finnish', 'finnish.txt'),
+    ('french', 'french.txt'),
+    ('samoan', 'samoan.txt'),
+    ('parupa', 'parupa.txt'),
+    ('noisy_parupa_0', 'noisy_parupa/noisy_parupa_0_0.txt'),
+    ('noisy_parupa_50', 'noisy_parupa/noisy_parupa_50_0.txt'),
+    ('noisy_parupa_100', 'noisy_parupa/noisy_parupa_100_0.txt'),
+]
+
+# Synthetic corpora are sampled from the Parupa HMM at this noise level, so
+# that they contain many distinct words.
+SYNTHETIC_NOISE = 0.5
+DEFAULT_SYNTHETIC_SIZES = [100000, 1000000]
+
+COUNT_METHODS = [NGRAM]
+WEIGHTINGS = [NONE, PROBABILITY, CONDITIONAL_PROBABILITY, PMI, PPMI]
+DEFAULT_NS = [1, 2, 3]
+
+# The model of each corpus that is saved and clustered
+MODEL_N = 3
+MODEL_WEIGHTING = PPMI
+
+# The sizes of the 1D data sets the BIC is computed for, and the largest
+# number of clusters each is split into
+BIC_SIZES = [1000, 10000, 100000]
+BIC_MAX_CLUSTERS = 10
+
+# The number of strings generated from the HMM by each sampler. The original
+# sampler is much slower, so it is given fewer strings.
+HMM_SIZES = {'hmm': [10000], 'compiled': [10000, 100000, 1000000]}
+
+# Benchmarks
+CREATE_VECTOR_MODEL = 'create_vector_model'
+SAVE_VECTOR_MODEL = 'save_vector_model'
+DO_CLUSTERING = 'do_clustering'
+COMPUTE_BIC = 'compute_bic'
+GENERATE_STRINGSET = 'generate_stringset'
+BENCHMARKS = [
+    CREATE_VECTOR_MODEL, SAVE_VECTOR_MODEL, DO_CLUSTERING, COMPUTE_BIC,
+    GENERATE_STRINGSET
+]
+
+def measure(function, repeat=DEFAULT_REPEAT):
+    '''
+    Calls a function of no arguments repeat times, and then once more with
+    tracemalloc running to find its peak memory use, which is not timed
+    because tracing slows it down.
+
+    Returns a tuple of (list of wall times in seconds, peak memory in bytes,
+    return value of the last call). The peak memory covers everything
+    allocated through Python and numpy during the call.
+    '''
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    value = function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return times, peak, value
+
+def make_result(benchmark, corpus, params, times, peak, words=None,
+                cells=None):
+    '''
+    Returns the result of a benchmark as a dict. Throughput is computed from
+    the fastest time.
+
+    words: The number of words processed, if any.
+    cells: The number of cells of the matrix processed, if any.
+    '''
+    seconds = min(times)
+    result = {
+        'benchmark': benchmark, 'corpus': corpus, 'params': params,
+        'seconds': seconds, 'times': times, 'peak_mb': peak / 2 ** 20
+    }
+    if words is not None:
+        result['words'] = words
+        result['words_per_second'] = words / seconds
+    if cells is not None:
+        result['cells'] = cells
+        result['cells_per_second'] = cells / seconds
+    print('{} {} {}: {:.4f}s, {:.1f}MB'.format(
+        benchmark, corpus, json.dumps(params, sort_keys=True), seconds,
+        result['peak_mb']
+    ))
+    return result
+
+@contextmanager
+def quiet():
+    '''
+    Discards anything printed inside the context.
+    '''
+    with open(devnull, 'w') as f, redirect_stdout(f):
+        yield
+
+def count_words(corpus_file):
+    '''
+    Returns the number of words in a corpus, including duplicates.
+    '''
+    with open(corpus_file, 'r') as f:
+        return sum(1 for line in f if line.strip())
+
+def matrix_cells(matrix):
+    '''
+    Returns the number of cells in a matrix, including zeros.
+    '''
+    return matrix.shape[0] * matrix.shape[1]
+
+def make_synthetic_corpora(sizes, outdir, seed=DEFAULT_SEED,
+                           spec=DEFAULT_SPEC):
+    '''
+    Samples a synthetic Parupa corpus with each of the provided numbers of
+    words into outdir. Returns a list of (name, path) tuples.
+    '''
+    hmm = load_hmm(spec).compile(noise=SYNTHETIC_NOISE)
+    streams = np.random.SeedSequence(seed).spawn(len(sizes))
+    corpora = []
+    for size, stream in zip(sizes, streams):
+        name = 'synthetic_{}'.format(size)
+        outfile = path.join(outdir, name + '.txt')
+        generate_corpus(hmm, size, outfile, stream)
+        corpora.append((name, outfile))
+    return corpora
+
+def benchmark_create_vector_model(corpora, ns, weightings, repeat):
+    '''
+    Benchmarks building a vector model of each corpus from scratch, for
+    every combination of counting method, n and weighting method.
+    '''
+    results = []
+    for name, corpus_file in corpora:
+        words = count_words(corpus_file)
+        for count_method in COUNT_METHODS:
+            for n in ns:
+                for weighting in weightings:
+                    def build():
+                        builder = VectorModelBuilder(
+                            corpus_file, count_method=count_method,
+                            weighting=weighting, n=n
+                        )
+                        with quiet():
+                            builder.create_vector_model()
+                        return builder
+                    times, peak, builder = measure(build, repeat)
+                    params = {
+                        'count_method': count_method, 'n': n,
+                        'weighting': weighting
+                    }
+                    results.append(make_result(
+                        CREATE_VECTOR_MODEL, name, params, times, peak,
+                        words, matrix_cells(builder.matrix)
+                    ))
+    return results
+
+def build_models(corpora, outdir):
+    '''
+    Builds and saves the vector model of each corpus that is clustered.
+    Returns a dict mapping the name of each corpus to its builder.
+    '''
+    builders = {}
+    for name, corpus_file in corpora:
+        builder = VectorModelBuilder(
+            corpus_file, weighting=MODEL_WEIGHTING, n=MODEL_N, outdir=outdir,
+            outfile=name
+        )
+        with quiet():
+            builder.create_vector_model()
+        builder.save_vector_model()
+        builders[name] = builder
+    return builders
+
+def benchmark_save_vector_model(corpora, builders, outdir, repeat):
+    '''
+    Benchmarks saving the vector model of each corpus in each format.
+    '''
+    results = []
+    for name, corpus_file in corpora:
+        builder = builders[name]
+        for fmt in (vector_io.BINARY, vector_io.TEXT):
+            # The saved model is clustered later, so it's saved elsewhere
+            builder.outfile = '{}_save_{}'.format(name, fmt)
+            times, peak, _ = measure(
+                lambda: builder.save_vector_model(fmt), repeat
+            )
+            params = {
+                'n': MODEL_N, 'weighting': MODEL_WEIGHTING, 'format': fmt
+            }
+            results.append(make_result(
+                SAVE_VECTOR_MODEL, name, params, times, peak,
+                cells=matrix_cells(builder.matrix)
+            ))
+        builder.outfile = name
+    return results
+
+def benchmark_do_clustering(corpora, builders, outdir, repeat):
+    '''
+    Benchmarks finding the classes in the saved vector model of each
+    corpus with the default options of clusterer.py.
+    '''
+    results = []
+    for name, corpus_file in corpora:
+        stem = path.join(outdir, name)
+        output_file = path.join(outdir, name + '_classes.txt')
+        times, peak, classes = measure(
+            lambda: clusterer.do_clustering(
+                stem, output_file, constrain_partition=True,
+                constrain_pcs=True, verbose=False
+            ),
+            repeat
+        )
+        params = {
+            'n': MODEL_N, 'weighting': MODEL_WEIGHTING,
+            'clustering': clusterer.DEFAULT_CLUSTERING,
+            'pca': clusterer.DEFAULT_PCA
+        }
+        result = make_result(
+            DO_CLUSTERING, name, params, times, peak,
+            cells=matrix_cells(builders[name].matrix)
+        )
+        result['classes'] = len(classes)
+        results.append(result)
+    return results
+
+def benchmark_compute_bic(repeat, seed=DEFAULT_SEED):
+    '''
+    Benchmarks computing the BIC of clusterings of 1D data sets of several
+    sizes into 1 to BIC_MAX_CLUSTERS clusters, one clustering at a time with
+    compute_bic and all at once with compute_bics. The data is drawn from a
+    mixture of three Gaussians, and each clustering splits the sorted data
+    into equal contiguous runs.
+    '''
+    rng = np.random.default_rng(seed)
+    results = []
+    for size in BIC_SIZES:
+        X = rng.normal(rng.choice([-3, 0, 3], size), 1)
+        ranks = np.empty(size, dtype=int)
+        ranks[np.argsort(X)] = np.arange(size)
+        labelings = [
+            (ranks * k // size, k) for k in range(1, BIC_MAX_CLUSTERS + 1)
+        ]
+        # compute_bic takes a fitted k-means model
+        models = [
+            SimpleNamespace(labels_=labels, n_clusters=k)
+            for labels, k in labelings
+        ]
+
+        for name, function in (
+            (COMPUTE_BIC, lambda: [
+                clusterer.compute_bic(model, X) for model in models
+            ]),
+            ('compute_bics', lambda: clusterer.compute_bics(X, labelings))
+        ):
+            times, peak, _ = measure(function, repeat)
+            params = {'points': size, 'max_clusters': BIC_MAX_CLUSTERS}
+            results.append(make_result(
+                COMPUTE_BIC, 'gaussian_mixture', dict(params, function=name),
+                times, peak, cells=size * BIC_MAX_CLUSTERS
+            ))
+    return results
+
+def benchmark_generate_stringset(repeat, seed=DEFAULT_SEED, spec=DEFAULT_SPEC):
+    '''
+    Benchmarks generating strings from the Parupa HMM with the original
+    sampler, HMM.generate_stringset, and the compiled sampler,
+    CompiledHMM.generate_stringset.
+    '''
+    hmm = load_hmm(spec)
+    hmm.parameters['noise'] = SYNTHETIC_NOISE
+    compiled_hmm = hmm.compile()
+    samplers = {
+        'hmm': lambda n: hmm.generate_stringset(n),
+        'compiled': lambda n: compiled_hmm.generate_stringset(
+            n, np.random.default_rng(seed)
+        )
+    }
+
+    results = []
+    for sampler, sizes in sorted(HMM_SIZES.items()):
+        for size in sizes:
+            # The original sampler uses numpy's global random state
+            np.random.seed(seed)
+            times, peak, _ = measure(lambda: samplers[sampler](size), repeat)
+            params = {
+                'sampler': sampler, 'noise': SYNTHETIC_NOISE, 'strings': size
+            }
+            results.append(make_result(
+                GENERATE_STRINGSET, hmm.name, params, times, peak, words=size
+            ))
+    return results
+
+def git_commit():
+    '''
+    Returns the hash of the current git commit, followed by '-dirty' if
+    there are uncommitted changes, or None if it can't be found.
+    '''
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, universal_newlines=True, check=True
+        ).stdout.strip()
+        status = subprocess.run(
+            ['git', 'status', '--porcelain', '--untracked-files=no'],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + '-dirty' if status else commit
+
+def environment():
+    '''
+    Returns a dict describing the code and machine the benchmarks ran on.
+    '''
+    return {
+        'commit': git_commit(),
+        'date': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'sklearn': sklearn.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpus': cpu_count()
+    }
+
+def run_benchmarks(benchmarks=BENCHMARKS, corpus_names=None,
+                   corpus_dir=DEFAULT_CORPUS_DIR,
+                   synthetic_sizes=DEFAULT_SYNTHETIC_SIZES, ns=DEFAULT_NS,
+                   weightings=WEIGHTINGS, repeat=DEFAULT_REPEAT,
+                   seed=DEFAULT_SEED):
+    '''
+    Runs the selected benchmarks and returns a dict holding the environment
+    they ran in and a list of their results.
+
+    corpus_names: The names of the shipped corpora to use (see CORPORA). All
+                  are used if this is None.
+    synthetic_sizes: The number of words in each synthetic corpus.
+    ns, weightings: The values of n and weighting methods that vector models
+                    are built with.
+    repeat: The number of times each benchmark is timed. The fastest time
+            is reported.
+    seed: Seeds the synthetic corpora and other random data, so every run
+          measures the same work.
+    '''
+    for benchmark in benchmarks:
+        if benchmark not in BENCHMARKS:
+            raise ValueError(
+                "'{}' is not a valid benchmark. Available benchmarks are: "
+                "{}".format(benchmark, ','.join(BENCHMARKS))
+            )
+    shipped = dict(CORPORA)
+    if corpus_names is None:
+        corpus_names = [name for name, _ in CORPORA]
+    for name in corpus_names:
+        if name not in shipped:
+            raise ValueError(
+                "'{}' is not a valid corpus. Available corpora are: "
+                "{}".format(name, ','.join(shipped))
+            )
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        corpora = [
+            (name, path.join(corpus_dir, shipped[name]))
+            for name in corpus_names
+        ]
+        corpora.extend(make_synthetic_corpora(synthetic_sizes, tmpdir, seed))
+
+        if CREATE_VECTOR_MODEL in benchmarks:
+            results.extend(benchmark_create_vector_model(
+                corpora, ns, weightings, repeat
+            ))
+        if SAVE_VECTOR_MODEL in benchmarks or DO_CLUSTERING in benchmarks:
+            builders = build_models(corpora, tmpdir)
+            if SAVE_VECTOR_MODEL in benchmarks:
+                results.extend(benchmark_save_vector_model(
+                    corpora, builders, tmpdir, repeat
+                ))
+            if DO_CLUSTERING in benchmarks:
+                results.extend(benchmark_do_clustering(
+                    corpora, builders, tmpdir, repeat
+                ))
+        if COMPUTE_BIC in benchmarks:
+            results.extend(benchmark_compute_bic(repeat, seed))
+        if GENERATE_STRINGSET in benchmarks:
+            results.extend(benchmark_generate_stringset(repeat, seed))
+
+    return {
+        'environment': environment(),
+        'settings': {
+            'benchmarks': benchmarks, 'corpora': corpus_names,
+            'synthetic_sizes': synthetic_sizes, 'ns': ns,
+            'weightings': weightings, 'repeat': repeat, 'seed': seed
+        },
+        'results': results
+    }
+
+def save_results(results, output_file):
+    '''
+    Saves the results of a run to a JSON file. The file is written to a
+    temporary file first so an interrupted run can't corrupt it.
+    '''
+    with open(output_file + '.tmp', 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    replace(output_file + '.tmp', output_file)
+
+def result_key(result):
+    '''
+    Returns the key that identifies the same benchmark in different runs.
+    '''
+    return (
+        result['benchmark'], result['corpus'],
+        json.dumps(result['params'], sort_keys=True)
+    )
+
+def compare_results(baseline, results, tolerance):
+    '''
+    Prints the ratio of the time and peak memory of each benchmark to those
+    of the same benchmark in a baseline run, marking benchmarks that have
+    become slower by more than the tolerance (e.g. 0.1 for 10%). Returns
+    the keys of those benchmarks.
+    '''
+    print('Comparing with commit {}'.format(
+        baseline['environment'].get('commit')
+    ))
+    old_results = {
+        result_key(result): result for result in baseline['results']
+    }
+    regressions = []
+    for result in results['results']:
+        key = result_key(result)
+        old = old_results.get(key)
+        if old is None:
+            continue
+        time_ratio = result['seconds'] / old['seconds']
+        memory_ratio = result['peak_mb'] / max(old['peak_mb'], 1e-9)
+        slower = time_ratio > 1 + tolerance
+        if slower:
+            regressions.append(key)
+        print('{:<8} {:.2f}x time {:.2f}x memory  {} {} {}'.format(
+            'SLOWER' if slower else '', time_ratio, memory_ratio, *key
+        ))
+    print('{} of {} benchmarks are slower by more than {:.0%}'.format(
+        len(regressions), len(results['results']), tolerance
+    ))
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark building, saving and clustering vector models '
+                    'and generating corpora.'
+    )
+    parser.add_argument(
+        '--output', type=str, default=DEFAULT_OUTPUT,
+        help='The JSON file to save the results to.'
+    )
+    parser.add_argument(
+        '--benchmarks', type=str, nargs='+', default=BENCHMARKS,
+        help='The benchmarks to run: {}. All are run by default.'.format(
+            ', '.join('"{}"'.format(benchmark) for benchmark in BENCHMARKS)
+        )
+    )
+    parser.add_argument(
+        '--corpora', type=str, nargs='*', default=None,
+        help='The shipped corpora to benchmark: {}. All are used by '
+             'default.'.format(', '.join(name for name, _ in CORPORA))
+    )
+    parser.add_argument(
+        '--corpus_dir', type=str, default=DEFAULT_CORPUS_DIR,
+        help='The directory holding the shipped corpora.'
+    )
+    parser.add_argument(
+        '--synthetic_sizes', type=int, nargs='*',
+        default=DEFAULT_SYNTHETIC_SIZES,
+        help='The number of words in each synthetic Parupa corpus. Give no '
+             'values to skip the synthetic corpora.'
+    )
+    parser.add_argument(
+        '--n', type=int, nargs='+', default=DEFAULT_NS,
+        help='The values of n to build vector models with.'
+    )
+    parser.add_argument(
+        '--weighting', type=str, nargs='+', default=WEIGHTINGS,
+        help='The weighting methods to build vector models with.'
+    )
+    parser.add_argument(
+        '--repeat', type=int, default=DEFAULT_REPEAT,
+        help='The number of times each benchmark is timed. The fastest time '
+             'is reported.'
+    )
+    parser.add_argument(
+        '--seed', type=int, default=DEFAULT_SEED,
+        help='Seeds the synthetic corpora and other random data.'
+    )
+    parser.add_argument(
+        '--compare', type=str, default=None,
+        help='The results file of an earlier run to compare with.'
+    )
+    parser.add_argument(
+        '--tolerance', type=float, default=0.1,
+        help='How much slower than in the earlier run a benchmark must be '
+             'to be reported as slower, as a fraction.'
+    )
+
+    args = parser.parse_args()
+    if args.repeat < 1:
+        parser.error('--repeat must be at least 1')
+    results = run_benchmarks(
+        args.benchmarks, args.corpora, args.corpus_dir, args.synthetic_sizes,
+        args.n, args.weighting, args.repeat, args.seed
+    )
+    save_results(results, args.output)
+    print('Results saved to {}'.format(args.output))
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        compare_results(baseline, results, args.tolerance)
@@ -0,0 +1,143 @@
+import argparse
+import batch
+import clusterer
+import csv
+import sys
+import time
+import vector_io
+
+from os import listdir, makedirs
+from os.path import basename, join
+
+'''
+Convenience script that finds the classes in all vector models in a folder,
+and writes a summary table of the results.
+'''
+
+DEFAULT_INDIR = '../vector_data/noisy_parupa/'
+DEFAULT_OUTDIR = '../found_classes/noisy_parupa/'
+DEFAULT_JOBS = 1
+
+CLASSES_SUFFIX = '_classes.txt'
+SUMMARY_FILE = 'summary.tsv'
+SUMMARY_FIELDS = ['model', 'sounds', 'classes', 'subsets', 'seconds', 'error']
+
+def find_stems(indir):
+    '''
+    Returns the sorted stems of all vector models in indir, that is, every
+    stem with a .sounds file and a file of vectors in any format.
+    '''
+    return sorted(
+        join(indir, f[:-len(vector_io.SOUND_EXT)]) for f in listdir(indir)
+        if f.endswith(vector_io.SOUND_EXT)
+        and vector_io.value_files(join(indir, f[:-len(vector_io.SOUND_EXT)]))
+    )
+
+def cluster_model(stem, outdir, v_scalar, constrain_partition, constrain_pcs,
+                  clustering=clusterer.DEFAULT_CLUSTERING,
+                  pca=clusterer.DEFAULT_PCA):
+    '''
+    Finds and saves the classes in a single vector model. Returns the row of
+    the summary table for the model.
+    '''
+    start = time.time()
+    cache = clusterer.PartitionCache()
+    classes = clusterer.do_clustering(
+        stem, join(outdir, basename(stem) + CLASSES_SUFFIX), v_scalar,
+        constrain_partition, constrain_pcs, clustering, cache=cache,
+        verbose=False, pca=pca
+    )
+    return {
+        'model': basename(stem), 'sounds': len(classes[0]),
+        'classes': len(classes), 'subsets': cache.misses,
+        'seconds': '{:.2f}'.format(time.time() - start), 'error': ''
+    }
+
+def save_summary(outdir, rows):
+    '''
+    Saves the summary table of a batch to a tab-separated file in outdir,
+    sorted by model name. Returns the path of the file.
+    '''
+    summary_path = join(outdir, SUMMARY_FILE)
+    with open(summary_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, SUMMARY_FIELDS, delimiter='\t')
+        writer.writeheader()
+        writer.writerows(sorted(rows, key=lambda row: row['model']))
+    return summary_path
+
+def cluster_dir(indir, outdir, v_scalar=clusterer.DEFAULT_VARIABILITY_SCALAR,
+                constrain_partition=clusterer.DEFAULT_CONSTRAIN_PARTITIONS,
+                constrain_pcs=clusterer.DEFAULT_CONSTRAIN_PCS,
+                clustering=clusterer.DEFAULT_CLUSTERING, jobs=DEFAULT_JOBS,
+                pca=clusterer.DEFAULT_PCA):
+    '''
+    Finds the classes in every vector model in indir. The classes of the
+    model with stem <stem> are saved to <stem>_classes.txt in outdir, and a
+    table summarizing every model is saved to summary.tsv in outdir.
+
+    jobs: The number of models to cluster in parallel, each in its own
+          process. 0 uses one process per CPU.
+
+    A model that fails to cluster is reported and skipped, rather than
+    stopping the whole batch, and its error is recorded in the summary.
+    Returns a list of (stem, error) tuples for the models that failed.
+    '''
+    stems = find_stems(indir)
+    makedirs(outdir, exist_ok=True)
+    clusterer_args = (
+        outdir, v_scalar, constrain_partition, constrain_pcs, clustering, pca
+    )
+    rows = []
+    failures = []
+    start = time.time()
+
+    results = batch.run_batch(cluster_model, stems, clusterer_args, jobs)
+    for done, (stem, row, error) in enumerate(results, 1):
+        if error is None:
+            print('[{}/{}] {}: {} classes in {}s'.format(
+                done, len(stems), row['model'], row['classes'], row['seconds']
+            ))
+            rows.append(row)
+        else:
+            print('[{}/{}] {} FAILED: {!r}'.format(
+                done, len(stems), basename(stem), error
+            ), file=sys.stderr)
+            failures.append((stem, error))
+            rows.append({'model': basename(stem), 'error': repr(error)})
+    summary_path = save_summary(outdir, rows)
+
+    print('Clustered {} of {} models in {:.2f}s. Summary saved to {}'.format(
+        len(stems) - len(failures), len(stems), time.time() - start,
+        summary_path
+    ))
+    for stem, error in sorted(failures, key=lambda failure: failure[0]):
+        print('Failed: {} ({!r})'.format(stem, error), file=sys.stderr)
+    return failures
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Find the classes in a directory of vector models.'
+    )
+    parser.add_argument(
+        '--indir', default=DEFAULT_INDIR, type=str,
+        help='The directory of vector models that will be clustered.'
+    )
+    parser.add_argument(
+        '--outdir', type=str, default=DEFAULT_OUTDIR,
+        help='The directory to save the classes and summary table in.'
+    )
+    clusterer.add_clustering_arguments(parser, jobs=False)
+    parser.add_argument(
+        '--jobs', type=int, default=DEFAULT_JOBS,
+        help='The number of models to cluster in parallel. 0 uses one '
+             'process per CPU.'
+    )
+
+    args = parser.parse_args()
+    failures = cluster_dir(
+        args.indir, args.outdir, args.v_scalar,
+        args.no_constrain_initial_partition, args.no_constrain_initial_pcs,
+        args.clustering, args.jobs, args.pca
+    )
+    if failures:
+        sys.exit(1)
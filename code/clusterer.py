@@ -1,7 +1,13 @@
 import argparse
+import batch
 import numpy as np
+import vector_io
 
-from math import exp, log, pi
+from concurrent.futures import ProcessPoolExecutor
+from math import log, pi
+from scipy import sparse
+from scipy.sparse.linalg import LinearOperator, svds
+from scipy.special import logsumexp
 from sklearn.cluster import KMeans
 from sklearn.decomposition import PCA
 
@@ -9,9 +15,20 @@ DEFAULT_VARIABILITY_SCALAR = 1
 DEFAULT_CONSTRAIN_PARTITIONS = True
 DEFAULT_CONSTRAIN_PCS = True
 
-VALUE_EXT = '.data'
-SOUND_EXT = '.sounds'
-CONTEXT_EXT = '.contexts'
+# 1D clustering methods
+DP = 'dp'
+KMEANS = 'kmeans'
+DEFAULT_CLUSTERING = DP
+
+# PCA strategies
+AUTO = 'auto'
+FULL = 'full'
+GRAM = 'gram'
+RANDOMIZED = 'randomized'
+TRUNCATED = 'truncated'
+DEFAULT_PCA = AUTO
+
+DEFAULT_JOBS = 1
 
 def remove_duplicates(my_list):
     seen = set()
@@ -23,131 +40,589 @@ def remove_duplicates(my_list):
 
 def do_clustering(input_file_stem, output_file, v_scalar=DEFAULT_VARIABILITY_SCALAR, 
                   constrain_partition=False,
-                  constrain_pcs=False):
-    values = np.loadtxt(input_file_stem + VALUE_EXT)
-    with open(input_file_stem + SOUND_EXT, 'r') as sound_file:
-        sounds = sound_file.read().strip().split(' ')
-    with open(input_file_stem + CONTEXT_EXT, 'r') as context_file:
-        contexts = context_file.read().strip().split(' ')
+                  constrain_pcs=False,
+                  clustering=DEFAULT_CLUSTERING,
+                  cache=None,
+                  jobs=DEFAULT_JOBS,
+                  verbose=True,
+                  pca=DEFAULT_PCA):
+    '''
+    Finds the classes of sounds in a saved vector model and saves them to
+    output_file, one class per line. Returns the list of classes.
 
+    cache: A PartitionCache shared with earlier calls on the same vector
+           model, whose partitions are reused. A new cache is used if None.
+    verbose: If True, the classes are printed, along with the cache
+             statistics if a cache was passed in.
+    '''
+    values, sounds, contexts = vector_io.load_vector_model(input_file_stem)
+
+    # A new cache can't have any hits, so its statistics aren't worth printing
+    show_cache = verbose and cache is not None
+    if cache is None:
+        cache = PartitionCache()
+    classes = cluster_vectors(
+        values, sounds, v_scalar, constrain_partition, constrain_pcs,
+        clustering, cache, jobs, pca
+    )
+
+    if show_cache:
+        print("Partition cache: {}".format(cache))
+    save_classes(classes, output_file, verbose)
+    return classes
+
+def cluster_vectors(values, sounds, v_scalar=DEFAULT_VARIABILITY_SCALAR,
+                    constrain_partition=False,
+                    constrain_pcs=False,
+                    clustering=DEFAULT_CLUSTERING,
+                    cache=None,
+                    jobs=DEFAULT_JOBS,
+                    pca=DEFAULT_PCA):
+    '''
+    Finds the classes of sounds in a vector model that is already in memory,
+    such as the matrix and sound_idx of a VectorModelBuilder. Returns the
+    list of classes, starting with the class of all sounds, without
+    duplicates.
+    '''
+    if cache is None:
+        cache = PartitionCache()
+    values = prepare_vectors(values, pca)
+    jobs = batch.process_count(jobs)
+    if jobs > 1:
+        expand_subsets(
+            values, sounds, v_scalar, constrain_partition, constrain_pcs,
+            clustering, cache, jobs, pca
+        )
+        # find_classes only replays the subsets looked up above
+        cache.counting = False
     classes = [tuple(sounds)]
-    classes.extend(find_classes(values, sounds, v_scalar, constrain_partition, constrain_pcs))
-    classes = remove_duplicates(classes)
+    try:
+        classes.extend(find_classes(
+            values, sounds, v_scalar, constrain_partition, constrain_pcs,
+            clustering=clustering, cache=cache, pca=pca
+        ))
+    finally:
+        cache.counting = True
+    return remove_duplicates(classes)
+
+def save_classes(classes, output_file, verbose=True):
+    '''
+    Saves a list of classes to output_file, one class per line with its
+    sounds separated by spaces.
 
-    print("Found classes:")
+    verbose: If True, the classes are printed as well.
+    '''
+    if verbose:
+        print("Found classes:")
 
     with open(output_file, 'w') as f:
         for c in classes:
-            print(c)
+            if verbose:
+                print(c)
             print(' '.join(c), file=f)
 
-def calculate_mean_and_variance(X, n):
+def compute_bics(X, labelings):
     '''
-    Calculate the mean and variance of a cluster
+    Computes the BIC of several clusterings of the same 1D data in a single
+    batched computation. Each cluster is modelled as a Gaussian, and the
+    likelihood of each point is a mixture of these Gaussians weighted by
+    the cluster sizes.
+
+    X: The data points, as an array of shape (n,) or (n, 1).
+    labelings: A list of (labels, n_clusters) tuples, one per clustering,
+               where labels gives the cluster (0 to n_clusters - 1) of
+               each point.
+
+    Returns an array with the BIC of each clustering, which is -inf for
+    clusterings with an empty cluster.
     '''
-    my_sum = 0
-    sumsq = 0
-
-    sorted_X = sorted(X)
-
-    median = sorted_X[len(sorted_X) // 2]
-    for item in sorted_X:
-        my_sum += item - median
-        sumsq += (item - median) * (item - median)
-    mean = my_sum / n + median
-
-    if n > 1:
-        variance = (sumsq - my_sum * my_sum / n) / (n - 1)
-    else:
-        variance = 0
+    X = np.asarray(X, dtype=float).ravel()
+    num_points = len(X)
+    # Shared by every clustering to find the neighbours of a cluster's mean
+    X_sorted = np.sort(X)
 
-    return mean, variance
-
-def compute_bic(kmeans, X):
-    centers = [kmeans.cluster_centers_]
-    labels  = kmeans.labels_
-    # number of clusters
-    m = kmeans.n_clusters
-    # size of the clusters
-    n = np.bincount(labels)
-
-    if len(n) != m:
-        # We've got a cluster with 0 elements in it. This rarely happens, but
-        # should result in infinite BIC.
-        return -np.inf
-
-    lamb = []
-    coeff = []
+    # The Gaussians of all clusterings are scored together. Each clustering
+    # owns a contiguous slice of them.
     means = []
     sigmas = []
-
-    for k in range(m):
-        lamb.append(n[k] / len(labels))
-        mean, variance = calculate_mean_and_variance(X[np.where(labels == k)], n[k])
-        means.append(mean)
-        sigmas.append(variance)
-
-        # If we can't calculate variance within cluster, use minimum distance to point
-        # in other cluster.
-        if variance == 0 or n[k] == 1:
-            X_sorted = np.copy(X).reshape(1, -1)[0]
-            X_sorted.sort()
-            left = min(np.where(X_sorted == means[k])[0]) - 1
-            right = max(np.where(X_sorted == means[k])[0]) + 1
-
-            if right >= len(X):
+    log_coeffs = []
+    slices = []
+    bics = np.full(len(labelings), -np.inf)
+
+    for labels, m in labelings:
+        labels = np.asarray(labels)
+        # size of the clusters
+        n = np.bincount(labels, minlength=m)
+        if len(n) != m or not n.all():
+            # We've got a cluster with 0 elements in it. This rarely happens,
+            # but should result in infinite BIC.
+            slices.append(None)
+            continue
+
+        # Sort the points by cluster, and by value within each cluster
+        order = np.lexsort((X, labels))
+        values = X[order]
+        starts = np.concatenate(([0], np.cumsum(n)[:-1]))
+
+        # Accumulate around the median of each cluster to limit rounding
+        # error in the variance.
+        median = values[starts + n // 2]
+        deviations = values - np.repeat(median, n)
+        my_sum = np.add.reduceat(deviations, starts)
+        sumsq = np.add.reduceat(deviations * deviations, starts)
+        mean = my_sum / n + median
+        with np.errstate(divide='ignore', invalid='ignore'):
+            variance = np.where(
+                n > 1, (sumsq - my_sum * my_sum / n) / (n - 1), 0
+            )
+
+        # If we can't calculate variance within cluster, use minimum distance
+        # to point in other cluster.
+        sigma = variance.copy()
+        for k in np.flatnonzero((variance == 0) | (n == 1)):
+            left = np.searchsorted(X_sorted, mean[k], 'left') - 1
+            right = np.searchsorted(X_sorted, mean[k], 'right')
+
+            if right >= num_points:
                 dmin = X_sorted[left + 1] - X_sorted[left]
             elif left < 0:
                 dmin = X_sorted[right] - X_sorted[right - 1]
             else:
                 dmin = min(
-                    X_sorted[left + 1] - X_sorted[left], 
+                    X_sorted[left + 1] - X_sorted[left],
                     X_sorted[right] - X_sorted[right - 1]
                 )
 
-            if variance == 0:
-                sigmas[-1] = dmin * dmin / 4.0 / 9.0
+            if variance[k] == 0:
+                sigma[k] = dmin * dmin / 4.0 / 9.0
             if n[k] == 1:
-                sigmas[-1] = dmin * dmin
+                sigma[k] = dmin * dmin
+
+        slices.append(slice(len(means), len(means) + m))
+        means.extend(mean)
+        sigmas.extend(sigma)
+        with np.errstate(divide='ignore'):
+            log_coeffs.extend(
+                np.log(n / num_points) - 0.5 * np.log(2.0 * pi * sigma)
+            )
+
+    if not means:
+        return bics
+
+    means = np.array(means)
+    sigmas = np.array(sigmas)
+    # The log density of every point under every Gaussian
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_densities = np.array(log_coeffs) - (
+            (X[:, None] - means) ** 2 / (2 * sigmas)
+        )
+
+    for i, ((labels, m), components) in enumerate(zip(labelings, slices)):
+        if components is None:
+            continue
+        log_likelihood = logsumexp(log_densities[:, components], axis=1).sum()
+        # (3 * m - 1) is used because each of the clusters has three
+        # associated parameters:
+        # * the cluster centroid coordinate
+        # * the cluster variance
+        # * the cluster probability
+        # The -1 is because the probabilities must sum to 1, so there are
+        # only m-1 free probs.
+        bics[i] = 2 * log_likelihood - (3 * m - 1) * log(num_points)
+    return bics
 
-        coeff.append(lamb[k] / (2.0 * pi * sigmas[-1])**0.5)
+def compute_bic(kmeans, X):
+    '''
+    Computes the BIC of a fitted 1D k-means clustering of X.
+    '''
+    return compute_bics(X, [(kmeans.labels_, kmeans.n_clusters)])[0]
 
-    log_likelihood = 0
-    for item in X:
-        likelihood = 0
-        for k in range(m):
-            likelihood += coeff[k] * exp(-(item - means[k]) * (item - means[k]) / (2 * sigmas[k]))
-        log_likelihood += log(likelihood)
+def kmeans_1d(X, max_clusters):
+    '''
+    Exact 1D k-means clustering by dynamic programming, as in the
+    Ckmeans.1d.dp R package. The optimal clusters of 1D data are contiguous
+    runs of the sorted data, so the best partition of the first j points
+    into k clusters can be built from the best partitions into k - 1
+    clusters, with the cost of each candidate cluster taken from prefix
+    sums. Unlike sklearn's KMeans, this is deterministic and always finds
+    the partition with the lowest within-cluster sum of squares.
+
+    Returns a list whose (k - 1)th element holds the labels of the optimal
+    clustering into k clusters, for k from 1 to max_clusters (or the number
+    of points, if smaller). Clusters are numbered from left to right.
+    '''
+    X = np.asarray(X, dtype=float).ravel()
+    num_points = len(X)
+    max_clusters = min(max_clusters, num_points)
+    order = np.argsort(X, kind='stable')
+    # Centering reduces cancellation in the prefix sum costs
+    X_sorted = X[order] - X.mean()
+
+    # cost[i, j] is the sum of squares of the cluster X_sorted[i:j + 1]
+    prefix = np.concatenate(([0], np.cumsum(X_sorted)))
+    prefix_sq = np.concatenate(([0], np.cumsum(X_sorted * X_sorted)))
+    start = np.arange(num_points)[:, None]
+    end = np.arange(num_points)[None, :]
+    size = end - start + 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sums = prefix[end + 1] - prefix[start]
+        cost = np.where(
+            size > 0,
+            np.maximum(
+                prefix_sq[end + 1] - prefix_sq[start] - sums * sums / size, 0
+            ),
+            np.inf
+        )
+
+    # best[k, j] is the lowest cost of splitting the first j + 1 points into
+    # k + 1 clusters, and first[k, j] is where the last of those clusters
+    # starts.
+    best = np.full((max_clusters, num_points), np.inf)
+    first = np.zeros((max_clusters, num_points), dtype=int)
+    best[0] = cost[0]
+    for k in range(1, max_clusters):
+        candidates = best[k - 1][:-1, None] + cost[1:]
+        first[k] = np.argmin(candidates, axis=0) + 1
+        best[k] = candidates[first[k] - 1, np.arange(num_points)]
+
+    labelings = []
+    for k in range(max_clusters):
+        sorted_labels = np.zeros(num_points, dtype=int)
+        end_point = num_points
+        for cluster in range(k, 0, -1):
+            start_point = first[cluster, end_point - 1]
+            sorted_labels[start_point:end_point] = cluster
+            end_point = start_point
+        labels = np.empty(num_points, dtype=int)
+        labels[order] = sorted_labels
+        labelings.append(labels)
+    return labelings
+
+def cluster_1d(X, max_clusters, clustering=DEFAULT_CLUSTERING):
+    '''
+    Clusters 1D data into each number of clusters from 1 to max_clusters,
+    using either exact dynamic programming ('dp') or sklearn's KMeans
+    ('kmeans'). Returns a list of (labels, n_clusters) tuples, one per
+    number of clusters.
+    '''
+    if clustering == DP:
+        return [
+            (labels, k + 1)
+            for k, labels in enumerate(kmeans_1d(X, max_clusters))
+        ]
+    elif clustering == KMEANS:
+        X = np.asarray(X).reshape(-1, 1)
+        return [
+            (KMeans(n_clusters=j).fit(X).labels_, j)
+            for j in range(1, max_clusters + 1)
+        ]
+    else:
+        raise ValueError(
+            "'{}' is not a valid clustering method. Available clustering "
+            "methods are: {}".format(clustering, ','.join([DP, KMEANS]))
+        )
 
-    # (3 * m - 1) is used because each of the clusters has three associated parameters:
-    # * the cluster centroid coordinate
-    # * the cluster variance
-    # * the cluster probability 
-    # The -1 is because the probabilities must sum to 1, so there are only m-1 free probs.
-    bic = 2 * log_likelihood - (3 * m - 1) * log(len(X))
-    return bic
+class GramMatrix:
+    '''
+    The Gram matrix X X^T of the rows of a vector model X, which stands in
+    for the model itself in find_classes when the 'gram' PCA strategy is
+    used. Indexing it with a list of rows returns the Gram matrix of those
+    rows, so the recursion only ever copies n_sounds x n_sounds matrices,
+    however many contexts the model has. Its shape is the shape of X.
+    '''
+    def __init__(self, gram, n_features):
+        self.gram = gram
+        self.n_features = n_features
+
+    @classmethod
+    def from_vectors(cls, input_data):
+        '''
+        Computes the Gram matrix of a (possibly sparse) vector model.
+        '''
+        gram = input_data @ input_data.T
+        if sparse.issparse(gram):
+            gram = gram.toarray()
+        return cls(np.asarray(gram, dtype=float), input_data.shape[1])
+
+    @property
+    def shape(self):
+        return (self.gram.shape[0], self.n_features)
+
+    def __getitem__(self, rows):
+        return GramMatrix(self.gram[np.ix_(rows, rows)], self.n_features)
+
+def resolve_pca(input_data, pca=DEFAULT_PCA):
+    '''
+    Returns the PCA strategy that 'auto' stands for on the input data, or pca
+    itself if it isn't 'auto'.
+    '''
+    if pca == AUTO:
+        if sparse.issparse(input_data) or isinstance(input_data, GramMatrix):
+            return GRAM
+        return FULL
+    return pca
 
-def find_classes(input_data, sounds, v_scalar=DEFAULT_VARIABILITY_SCALAR,
-                 constrain_partition=False,
-                 constrain_pcs=False,
-                 visited_classes=None):
+def prepare_vectors(input_data, pca=DEFAULT_PCA):
+    '''
+    Returns the form of the input data that find_classes should recurse on:
+    its GramMatrix if the 'gram' PCA strategy will be used, since every
+    recursive PCA can be done from it, and the input data itself otherwise.
+    '''
+    if resolve_pca(input_data, pca) == GRAM and not isinstance(
+        input_data, GramMatrix
+    ):
+        return GramMatrix.from_vectors(input_data)
+    return input_data
 
-    full_classes_list = []
+def gram_pca(input_data):
+    '''
+    Performs PCA on the rows of a (possibly sparse) matrix without centering
+    or densifying it, by eigendecomposing the doubly-centered Gram matrix.
+    This only requires an n_sounds x n_sounds dense matrix, however many
+    contexts there are. The input data can also be a precomputed GramMatrix.
 
-    if not visited_classes:
-        visited_classes = []
+    Returns the projection of the rows onto the principal components and the
+    variance explained by each component, ordered as in sklearn's PCA.
+    '''
+    if not isinstance(input_data, GramMatrix):
+        input_data = GramMatrix.from_vectors(input_data)
+    n_samples, n_features = input_data.shape
+    gram = input_data.gram
 
-    # Do PCA on the input data
-    pca = PCA()
-    pca_values = pca.fit_transform(input_data)
+    # Centering the rows of X corresponds to double-centering X X^T
+    row_means = gram.mean(axis=1, keepdims=True)
+    centered = gram - row_means - row_means.T + gram.mean()
 
-    if constrain_pcs:
-        highest_dim = 1
+    eigenvalues, eigenvectors = np.linalg.eigh(centered)
+    order = np.argsort(eigenvalues)[::-1][:min(n_samples, n_features)]
+    eigenvalues = np.clip(eigenvalues[order], 0, None)
+    eigenvectors = eigenvectors[:, order]
+
+    pca_values = eigenvectors * np.sqrt(eigenvalues)
+    explained_variance = eigenvalues / max(n_samples - 1, 1)
+    return pca_values, explained_variance
+
+class PartitionCache:
+    '''
+    Memoizes the partitions that find_classes finds for each subset of sounds
+    in a vector model, so each distinct subset is only decomposed and
+    clustered once, however many paths through the recursion reach it. A
+    subset is keyed on the frozenset of its sounds and the parameters it was
+    clustered with. A cache can be reused by several calls to find_classes
+    on the same vector model, but not across different vector models.
+
+    Lookups are counted as hits or misses unless counting is False, which is
+    used while find_classes replays partitions that expand_subsets has
+    already looked up, so the statistics don't depend on the number of jobs.
+    Within a single call find_classes skips any subset it has already
+    visited before looking it up, so every lookup is a miss; hits only count
+    subsets reused from an earlier call that shared the cache.
+    '''
+    def __init__(self):
+        self.partitions = {}
+        self.hits = 0
+        self.misses = 0
+        self.counting = True
+
+    def get(self, key):
+        '''
+        Returns the partitions cached for a key, or None if there are none.
+        '''
+        partitions = self.partitions.get(key)
+        if self.counting:
+            if partitions is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return partitions
+
+    def add(self, key, partitions):
+        self.partitions[key] = partitions
+
+    def __len__(self):
+        return len(self.partitions)
+
+    def __str__(self):
+        return '{} subsets cached, {} hits, {} misses'.format(
+            len(self), self.hits, self.misses
+        )
+
+def total_variance(input_data):
+    '''
+    Returns the total variance of the columns of a (possibly sparse) matrix,
+    which is the sum of the variance explained by all of its principal
+    components.
+    '''
+    n_samples = input_data.shape[0]
+    if sparse.issparse(input_data):
+        col_means = np.asarray(input_data.mean(axis=0)).ravel()
+        sum_squares = (
+            input_data.multiply(input_data).sum()
+            - n_samples * np.dot(col_means, col_means)
+        )
+    else:
+        input_data = np.asarray(input_data, dtype=float)
+        sum_squares = np.square(input_data - input_data.mean(axis=0)).sum()
+    return max(sum_squares, 0) / max(n_samples - 1, 1)
+
+def partial_pca(input_data, n_components, pca=RANDOMIZED):
+    '''
+    Computes only the first n_components principal components of a
+    (possibly sparse) matrix, without centering or densifying it. The
+    centered matrix is only ever multiplied by thin matrices, so this is
+    much cheaper than a full SVD when there are many contexts.
+
+    pca: 'truncated' uses ARPACK, which is exact to machine precision but
+         requires n_components to be less than the smaller dimension of the
+         matrix. 'randomized' uses a randomized range finder with power
+         iterations, which is faster on very large matrices but only
+         approximate when the variances of the components are close
+         together, as they often are for PPMI vectors. Both are seeded, so
+         they give the same result on every run.
+
+    Returns the projection of the rows onto the components and the variance
+    explained by each component, as gram_pca does.
+    '''
+    n_samples, n_features = input_data.shape
+    col_means = np.asarray(input_data.mean(axis=0)).ravel()
+    rng = np.random.RandomState(0)
+
+    # Products with the centered matrix X - 1 mu^T and its transpose
+    def centered_dot(M):
+        return np.asarray(input_data @ M) - np.outer(
+            np.ones(n_samples), col_means @ M
+        )
+
+    def centered_rdot(M):
+        return np.asarray(input_data.T @ M) - np.outer(col_means, M.sum(axis=0))
+
+    if pca == RANDOMIZED:
+        n_random = min(2 * n_components + 10, n_samples, n_features)
+        Q = centered_dot(rng.normal(size=(n_features, n_random)))
+        for _ in range(15):
+            Q, _ = np.linalg.qr(Q)
+            Q, _ = np.linalg.qr(centered_rdot(Q))
+            Q = centered_dot(Q)
+        Q, _ = np.linalg.qr(Q)
+        U, S, _ = np.linalg.svd(centered_rdot(Q).T, full_matrices=False)
+        U = Q @ U
+    elif pca == TRUNCATED:
+        operator = LinearOperator(
+            (n_samples, n_features), dtype=float,
+            matvec=lambda v: centered_dot(v.reshape(-1, 1)).ravel(),
+            rmatvec=lambda v: centered_rdot(v.reshape(-1, 1)).ravel(),
+            matmat=centered_dot, rmatmat=centered_rdot
+        )
+        U, S, _ = svds(
+            operator, k=n_components,
+            v0=rng.uniform(-1, 1, min(n_samples, n_features))
+        )
+        order = np.argsort(S)[::-1]
+        U, S = U[:, order], S[order]
     else:
-        # If we're looking at all PCs, calculate which ones we will examine
-        # based on scaled Kaiser's stopping criterion.
-        mean_eig = np.mean(pca.explained_variance_) * v_scalar
-        highest_dim = max(0, np.argmax(pca.explained_variance_ < mean_eig))
+        raise ValueError(
+            "'{}' is not a partial PCA strategy. Available strategies "
+            "are: {}".format(pca, ','.join([RANDOMIZED, TRUNCATED]))
+        )
+
+    U, S = U[:, :n_components], S[:n_components]
+    # Fix the signs so the largest coordinate on each component is positive
+    signs = np.sign(U[np.argmax(np.abs(U), axis=0), np.arange(U.shape[1])])
+    signs[signs == 0] = 1
+    pca_values = U * signs * S
+    explained_variance = S ** 2 / max(n_samples - 1, 1)
+    return pca_values, explained_variance
+
+def principal_components(input_data, v_scalar=DEFAULT_VARIABILITY_SCALAR,
+                         constrain_pcs=False, pca=DEFAULT_PCA):
+    '''
+    Does PCA on the input data. Returns the projection of the rows onto the
+    principal components that will be clustered over, and the number of
+    those components.
+
+    pca: The PCA strategy. 'full' uses sklearn's PCA, which densifies
+         sparse matrices. 'gram' eigendecomposes the Gram matrix (see
+         gram_pca), which is cheapest when there are far fewer sounds than
+         contexts. 'truncated' and 'randomized' only compute as many
+         components as are needed (see partial_pca), although 'randomized'
+         is approximate. 'auto' uses 'gram' for sparse matrices and 'full'
+         for dense matrices.
+    '''
+    pca = resolve_pca(input_data, pca)
+    if isinstance(input_data, GramMatrix) and pca != GRAM:
+        raise ValueError(
+            "A GramMatrix can only be used with the '{}' PCA "
+            "strategy".format(GRAM)
+        )
+
+    if pca in (FULL, GRAM):
+        if pca == GRAM:
+            pca_values, explained_variance = gram_pca(input_data)
+        else:
+            if sparse.issparse(input_data):
+                input_data = input_data.toarray()
+            full_pca = PCA()
+            pca_values = full_pca.fit_transform(input_data)
+            explained_variance = full_pca.explained_variance_
+        if constrain_pcs:
+            highest_dim = 1
+        else:
+            # If we're looking at all PCs, calculate which ones we will
+            # examine based on scaled Kaiser's stopping criterion.
+            mean_eig = np.mean(explained_variance) * v_scalar
+            highest_dim = max(0, np.argmax(explained_variance < mean_eig))
+        return pca_values, highest_dim
+
+    if pca not in (RANDOMIZED, TRUNCATED):
+        raise ValueError(
+            "'{}' is not a valid PCA strategy. Available strategies "
+            "are: {}".format(
+                pca, ','.join([AUTO, FULL, GRAM, RANDOMIZED, TRUNCATED])
+            )
+        )
+
+    # The mean variance over all components is needed for Kaiser's
+    # criterion, but it can be found from the total variance without
+    # computing every component.
+    max_components = min(input_data.shape)
+    mean_eig = total_variance(input_data) / max_components * v_scalar
+
+    # Compute more components until one falls below the threshold. If nearly
+    # all are needed, it's cheaper to compute them all at once.
+    n_components = 1
+    while True:
+        if n_components >= max_components - 1:
+            pca_values, explained_variance = gram_pca(input_data)
+            break
+        pca_values, explained_variance = partial_pca(
+            input_data, n_components, pca
+        )
+        if constrain_pcs or explained_variance[-1] < mean_eig:
+            break
+        n_components = min(2 * n_components, max_components - 1)
+
+    if constrain_pcs:
+        return pca_values[:, :1], 1
+    highest_dim = max(0, np.argmax(explained_variance < mean_eig))
+    return pca_values[:, :highest_dim], highest_dim
+
+def find_partitions(input_data, sounds, v_scalar=DEFAULT_VARIABILITY_SCALAR,
+                    constrain_partition=False,
+                    constrain_pcs=False,
+                    clustering=DEFAULT_CLUSTERING,
+                    pca=DEFAULT_PCA):
+    '''
+    Does PCA on the input data and clusters the sounds along each principal
+    component that passes the variance threshold. Returns a list with one
+    partition per component, each of which is a list of classes, and each
+    class a tuple of sounds in the order they appear in sounds.
+    '''
+    partitions = []
+
+    # Do PCA on the input data
+    pca_values, highest_dim = principal_components(
+        input_data, v_scalar, constrain_pcs, pca
+    )
 
     if constrain_partition:
         # Only cluster into a maximum of two classes
@@ -158,48 +633,154 @@ def find_classes(input_data, sounds, v_scalar=DEFAULT_VARIABILITY_SCALAR,
 
     # Go through all the PCS we want to cluster over
     for i in range(highest_dim):
-        classes_list = []
-        sub_classes = []
         col = pca_values[:, i]
-        col_reshaped = col.reshape(-1, 1)
 
         # Do 1D k-means clustering on this PC for all possible
         # numbers of clusters
-        k_clusters = []
-        bics = []
-
-        for j in range(1, max_clusters + 1):
-            kmeans = KMeans(n_clusters=j)
-            k_clusters.append(kmeans.fit(col_reshaped))
-            bics.append(compute_bic(kmeans, col_reshaped))
+        k_clusters = cluster_1d(col, max_clusters, clustering)
+        bics = compute_bics(col, k_clusters)
 
         # Choose the partition that results in the highest BIC
-        best_k = k_clusters[np.argmax(bics)]
-        k_results = [
-            [x for x in np.where(best_k.labels_ == y)[0]] 
-            for y in range(best_k.n_clusters)
-        ]
+        best_labels, best_n_clusters = k_clusters[np.argmax(bics)]
+        partitions.append([
+            tuple(sounds[idx] for idx in np.where(best_labels == y)[0])
+            for y in range(best_n_clusters)
+        ])
+
+    return partitions
+
+# The vector model being clustered by each worker process of expand_subsets
+_worker_data = None
+
+def _init_worker(input_data):
+    global _worker_data
+    _worker_data = input_data
+
+def _find_subset_partitions(subidx, subsounds, params):
+    return find_partitions(_worker_data[subidx], subsounds, *params)
+
+def expand_subsets(input_data, sounds, v_scalar=DEFAULT_VARIABILITY_SCALAR,
+                   constrain_partition=False,
+                   constrain_pcs=False,
+                   clustering=DEFAULT_CLUSTERING,
+                   cache=None,
+                   jobs=DEFAULT_JOBS,
+                   pca=DEFAULT_PCA):
+    '''
+    Finds the partitions of every subset of sounds that find_classes would
+    cluster, and stores them in the cache. The subsets are expanded breadth
+    first: the subsets at each depth are independent of each other, so they
+    are clustered in parallel by a pool of jobs processes, and the new
+    classes they produce are deduplicated before making up the next depth.
+
+    Calling find_classes with the filled cache afterwards only reads from
+    the cache, and returns exactly the classes it would have found on its
+    own, in the same order. Returns the cache.
+    '''
+    if cache is None:
+        cache = PartitionCache()
+    input_data = prepare_vectors(input_data, pca)
+    sound_idx = {sound: idx for idx, sound in enumerate(sounds)}
+    # Recursive calls to find_classes don't constrain the partitions or PCs
+    sub_params = (v_scalar, False, False, clustering, pca)
+
+    visited_classes = set()
+    params = (v_scalar, constrain_partition, constrain_pcs, clustering, pca)
+    level = [(tuple(sounds), params)]
+    with ProcessPoolExecutor(
+        max_workers=jobs, initializer=_init_worker, initargs=(input_data,)
+    ) as executor:
+        while level:
+            keys = [
+                (frozenset(subsounds),) + params for subsounds, params in level
+            ]
+            futures = {
+                key: executor.submit(
+                    _find_subset_partitions,
+                    [sound_idx[sound] for sound in subsounds], list(subsounds),
+                    params
+                )
+                for key, (subsounds, params) in zip(keys, level)
+                if cache.get(key) is None
+            }
+            for key, future in futures.items():
+                cache.add(key, future.result())
+
+            next_level = []
+            for key in keys:
+                for classes in cache.partitions[key]:
+                    for c in classes:
+                        visited_key = frozenset(c)
+                        if visited_key not in visited_classes and len(c) > 1:
+                            visited_classes.add(visited_key)
+                            next_level.append((c, sub_params))
+            level = next_level
+
+    return cache
 
-        # Add each discovered cluster to the list of discovered clusters
-        for cluster in k_results:
-            cur_class = [sounds[idx] for idx in cluster]
-            classes_list.append(cur_class)
+def find_classes(input_data, sounds, v_scalar=DEFAULT_VARIABILITY_SCALAR,
+                 constrain_partition=False,
+                 constrain_pcs=False,
+                 visited_classes=None,
+                 clustering=DEFAULT_CLUSTERING,
+                 cache=None,
+                 pca=DEFAULT_PCA):
+    '''
+    Recursively finds classes of sounds by clustering them along their
+    principal components, and then clustering each class that is found.
+    If the 'gram' PCA strategy is used, the Gram matrix of the input data is
+    computed once, and the recursive calls work on slices of it rather than
+    slices of the input data.
+
+    visited_classes: The set of classes (as frozensets of sounds) that have
+                     already been clustered, which are not clustered again.
+    cache: A PartitionCache shared by all the recursive calls. Passing in a
+           cache that was used on the same vector model before means subsets
+           that were already clustered are not clustered again.
+    '''
+    full_classes_list = []
+
+    if visited_classes is None:
+        visited_classes = set()
+    if cache is None:
+        cache = PartitionCache()
+    input_data = prepare_vectors(input_data, pca)
+
+    key = (
+        frozenset(sounds), v_scalar, constrain_partition, constrain_pcs,
+        clustering, pca
+    )
+    partitions = cache.get(key)
+    if partitions is None:
+        partitions = find_partitions(
+            input_data, sounds, v_scalar, constrain_partition, constrain_pcs,
+            clustering, pca
+        )
+        cache.add(key, partitions)
+
+    sound_idx = {sound: idx for idx, sound in enumerate(sounds)}
+
+    for classes in partitions:
+        classes_list = [list(c) for c in classes]
+        sub_classes = []
 
         # Perform recursive clustering on all discovered classes we haven't
         # seen yet.
         for c in classes_list:
             # Check that we haven't already clustered this subet. This isn't
             # strictly necessary, but saves some cycles.
-            if not c in visited_classes and len(c) > 1:
-                visited_classes.append(c)
+            visited_key = frozenset(c)
+            if visited_key not in visited_classes and len(c) > 1:
+                visited_classes.add(visited_key)
 
-                # Perform recursive clustering on this subset.
-                subidx = sorted([sounds.index(s) for s in c])
+                # Perform recursive clustering on this subset
+                subidx = sorted(sound_idx[sound] for sound in c)
                 subspace = input_data[subidx]
-                subsounds = [s for s in sounds if s in c]
+                subsounds = [sounds[idx] for idx in subidx]
                 found_subclasses = find_classes(
                     subspace, subsounds, v_scalar=v_scalar,
-                    visited_classes=visited_classes
+                    visited_classes=visited_classes, clustering=clustering,
+                    cache=cache, pca=pca
                 )
                 sub_classes.extend(found_subclasses)
         # Add classes from this call and all recursive calls to the list of
@@ -209,47 +790,79 @@ def find_classes(input_data, sounds, v_scalar=DEFAULT_VARIABILITY_SCALAR,
     # Returns founds classes
     return full_classes_list
     
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(
-        description = "Performs a combination of PCA and 1D k-means clustering "
-                      "to find phonological classes from an embedding."
+def add_clustering_arguments(parser, jobs=True):
+    '''
+    Adds the command line arguments that configure the clusterer to an
+    argparse parser, so every script that clusters accepts them in the same
+    form. The --jobs argument, which clusters subsets of sounds in parallel,
+    is left out if jobs is False, for scripts that parallelize differently.
+    '''
+    parser.add_argument(
+        '--v_scalar', type=float, default=DEFAULT_VARIABILITY_SCALAR,
+        help='A parameter that controls what amount of variance a principal '
+        'component must account for to be used in clustering. The threshold '
+        'is this value * (average amount of variance).'
     )
     parser.add_argument(
-        'input_file_stem', type=str, help='The stem of the set of input files.'
+        '--no_constrain_initial_partition', action='store_false',
+        default=DEFAULT_CONSTRAIN_PARTITIONS,
+        help='Remove the restriction that any partition of the full set of '
+        'sounds must be into two classes (e.g. consonants vs. vowels, voiced '
+        'vs. voiceless, etc.)'
     )
     parser.add_argument(
-        'output_file', type=str, 
-        help='Path to where the discovered classes will be saved.'
+        '--no_constrain_initial_pcs', action='store_false',
+        default=DEFAULT_CONSTRAIN_PCS,
+        help='Remove the restriction that only the first principal component '
+        'is considered for the initial partition of the full set of sounds. '
+        'The same classes are found as with the restriction, but additional '
+        'partitions of the full set may be found as well. Increasing '
+        '--v_scalar has a similar effect, but applies to every recursive '
+        'call to the clusterer rather than just the top level call.'
     )
     parser.add_argument(
-        '--v_scalar', type=float, 
-        help='A parameter that controls what amount of variance a principal '
-        'component must account for to be used in clustering. The threshold '
-        'is this value * (average amount of variance).',
-        default=DEFAULT_VARIABILITY_SCALAR
+        '--clustering', type=str, default=DEFAULT_CLUSTERING,
+        help='The method used for 1D k-means clustering of each principal '
+        'component: "dp" (the default) finds the optimal clusters exactly and '
+        'deterministically by dynamic programming, while "kmeans" uses '
+        'sklearn\'s KMeans, which is randomly initialized.'
     )
     parser.add_argument(
-        '--no_constrain_initial_partition', action='store_false',
-        help='A parameter that, if TRUE, sets restrictions on the initial '
-        'partition of the data set: namely, any partition of the full set of '
-        'sounds must be into two classes (e.g. consonants vs. vowels, voiced vs. '
-        'voiceless, etc.)',
-        default=DEFAULT_CONSTRAIN_PARTITIONS
+        '--pca', type=str, default=DEFAULT_PCA,
+        help='The PCA strategy: "full" uses sklearn\'s PCA, "gram" '
+        'eigendecomposes the Gram matrix, which is fastest when there are '
+        'far fewer sounds than contexts, and "truncated" and "randomized" '
+        'only compute the components that are needed, although "randomized" '
+        'is approximate. "auto" (the default) uses "gram" for sparse models '
+        'and "full" for dense ones.'
+    )
+    if jobs:
+        parser.add_argument(
+            '--jobs', type=int, default=DEFAULT_JOBS,
+            help='The number of processes used to cluster independent '
+            'subsets of sounds in parallel. 0 uses one process per CPU. The '
+            'classes found are the same regardless of this value.'
+        )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description = "Performs a combination of PCA and 1D k-means clustering "
+                      "to find phonological classes from an embedding."
+    )
+    parser.add_argument(
+        'input_file_stem', type=str,
+        help='The stem of the set of input files, or the path of the file of '
+        'vectors to use if the model has been saved in more than one format.'
     )
     parser.add_argument(
-        '--no_constrain_initial_pcs', action='store_false', 
-        help='A parameter that, if TRUE, restricts the initial partition of the '
-        'data set: namely, only the first principal component is considered. '
-        'Setting this to FALSE will result in the same classes being detected as '
-        'when it is TRUE, but with additional partitions of the data set potentially '
-        'discovered as well. Similar results can be gained by increasing '
-        'the variability scalar, but this will apply to all recursive calls to the '
-        'clusterer rather than just the top level call.',
-        default=DEFAULT_CONSTRAIN_PCS
+        'output_file', type=str, 
+        help='Path to where the discovered classes will be saved.'
     )
+    add_clustering_arguments(parser)
 
     args = parser.parse_args()
     do_clustering(
         args.input_file_stem, args.output_file, args.v_scalar, 
-        args.no_constrain_initial_partition, args.no_constrain_initial_pcs
+        args.no_constrain_initial_partition, args.no_constrain_initial_pcs,
+        args.clustering, jobs=args.jobs, pca=args.pca
     )
@@ -1,214 +1,101 @@
-from HMM import HMM, START, END
+from HMM import load_hmm
+from itertools import islice
 from os.path import join
 
 import argparse
+import batch
+import numpy as np
 
 '''
 A script to generate one or more Parupa corpora at the specified noise level.
+The Parupa HMM is defined in parupa_hmm.json, and its transition
+probabilities depend on the noise level. Other HMMs with a noise parameter
+can be used in its place with --spec.
 '''
 DEFAULT_CORPORA_PER_LEVEL = 10
 DEFAULT_CORPUS_SIZE = 50000
 DEFAULT_OUTDIR = '../corpora/noisy_parupa/'
+DEFAULT_SPEC = 'parupa_hmm.json'
+DEFAULT_JOBS = 1
 
-def generate_corpora(noise_levels, corpora_per_level, corpus_size, outdir):
+# The number of words written to a corpus file at once
+WRITE_BUFFER_SIZE = 10000
+
+def write_corpus(words, outfile, buffer_size=WRITE_BUFFER_SIZE):
+    '''
+    Writes words to outfile, one per line with their symbols separated by
+    spaces. The words can be any iterable, including a generator: they are
+    consumed and written buffer_size at a time, so the corpus never needs
+    to be held in memory.
+    '''
+    words = iter(words)
+    with open(outfile, 'w') as f:
+        while True:
+            buffer = list(islice(words, buffer_size))
+            if not buffer:
+                break
+            f.write(''.join(' '.join(word) + '\n' for word in buffer))
+
+def generate_corpus(compiled_hmm, corpus_size, outfile, seed_sequence):
+    '''
+    Generates a single corpus from a CompiledHMM and saves it to outfile. Its
+    words are sampled with a random number generator seeded by
+    seed_sequence, a numpy SeedSequence, so the same seed sequence always
+    gives the same corpus.
+    '''
+    rng = np.random.default_rng(seed_sequence)
+    write_corpus(compiled_hmm.generate_strings(corpus_size, rng), outfile)
+    return outfile
+
+def generate_task(task):
+    '''
+    Generates the corpus described by a (compiled_hmm, corpus_size, outfile,
+    seed_sequence) task tuple. Returns the path of the corpus.
+    '''
+    return generate_corpus(*task)
+
+def generate_corpora(noise_levels, corpora_per_level, corpus_size, outdir,
+                     seed=None, jobs=DEFAULT_JOBS, spec=DEFAULT_SPEC):
     '''
     noise_levels: A list of noise levels, between 0 and 1, for each of which
                    one or more corpora will be generated.
     corpora_per_level: The number of corpora to generate at each noise level.
     corpus_size: The number of tokens per corpus.
     outdir: The directory to save the corpora in
+    seed: An integer that seeds the random number generators. Each corpus
+          is generated from its own stream, spawned from this seed in the
+          order of noise_levels and then corpus number, so the same
+          arguments always produce the same corpora, however many jobs are
+          used. If None, a random seed is chosen and printed.
+    jobs: The number of corpora to generate in parallel, each in its own
+          process. 0 uses one process per CPU.
+    spec: The JSON file defining the HMM, which must have a noise
+          parameter. The corpora are named after the name of the HMM.
     '''
+    # The HMM is compiled once, and only its probabilities are recomputed
+    # for each noise level.
+    hmm = load_hmm(spec)
+    compiled_hmm = hmm.compile()
+    seed_sequence = np.random.SeedSequence(seed)
+    if seed is None:
+        print('Using seed {}'.format(seed_sequence.entropy))
+    streams = iter(seed_sequence.spawn(len(noise_levels) * corpora_per_level))
+
+    tasks = []
     for noise_level in noise_levels:
-        hmm = HMM()
-        print('Generating data at noise level {}'.format(noise_level))
-
-        # Add states
-        hmm.add_state(1, 'Front High Consonant')
-        hmm.add_state(2, 'Front Non-high Consonant')
-        hmm.add_state(3, 'Front Vowel')
-        hmm.add_state(4, 'Back High Consonant')
-        hmm.add_state(5, 'Back Non-high Consonant')
-        hmm.add_state(6, 'Back Vowel')
-        hmm.add_state(7, 'Noisy consonant')
-        hmm.add_state(8, 'Noisy vowel')
-
-        # Vowel inventory:
-        # front vowels: i, e
-        # back vowels: u, o
-        # transparent vowels: a
-        # Consonant inventory:
-        # Come before high vowels: t, k, p
-        # Come before non-high vowels: d, g, b
-        # Come word initially: p, b
-        # Come before anything: r
-
-        # Add transitions
-
-        hmm.add_transition(
-            START,
-            7,
-            [('p', 1/7),
-             ('t', 1/7), 
-             ('k', 1/7), 
-             ('b', 1/7), 
-             ('d', 1/7), 
-             ('g', 1/7), 
-             ('r', 1/7)],
-            noise_level
-        )
-
-        hmm.add_transition(
-            START,
-            1, 
-            [('p', 1)],
-            (1 - noise_level) / 4
-        )
-        hmm.add_transition(
-            START,
-            2,
-            [('b', 1)],
-            (1 - noise_level) / 4
-        )
-        hmm.add_transition(
-            START,
-            4, 
-            [('p', 1)],
-            (1 - noise_level) / 4
-        )
-        hmm.add_transition(
-            START,
-            5,
-            [('b', 1)],
-            (1 - noise_level) / 4
-        )
-
-        hmm.add_transition(
-            1,
-            3,
-            [('i', 1/2), 
-             ('a', 1/2)],
-            1
-        )
-        hmm.add_transition(
-            2,
-            3,
-            [('e', 1/2), 
-             ('a', 1/2)],
-            1
-        )
-        hmm.add_transition(
-            4,
-            6,
-            [('u', 1/2), 
-             ('a', 1/2)],
-            1
-        )
-        hmm.add_transition(
-            5,
-            6,
-            [('o', 1/2), 
-             ('a', 1/2)],
-            1
-        )
-
-        hmm.add_transition(
-            3,
-            1,
-            [('p', 1/4), 
-             ('t', 1/4), 
-             ('k', 1/4), 
-             ('r', 1/4)],
-            1/3
-        )
-
-        hmm.add_transition(
-            3,
-            2,
-            [('b', 1/4), 
-             ('d', 1/4), 
-             ('g', 1/4), 
-             ('r', 1/4)],
-            1/3
-        )
-
-        hmm.add_transition(
-            3,
-            END,
-            [('', 1)],
-            1/3
-        )
-
-        hmm.add_transition(
-            6,
-            4,
-            [('p', 1/4),
-             ('t', 1/4),
-             ('k', 1/4),
-             ('r', 1/4)],
-            1/3
-        )
-
-        hmm.add_transition(
-            6,
-            5,
-            [('b', 1/4),
-             ('d', 1/4),
-             ('g', 1/4),
-             ('r', 1/4)],
-            1/3
-        )
-
-        hmm.add_transition(
-            6,
-            END,
-            [('', 1)],
-            1/3
-        )
-
-        hmm.add_transition(
-            7,
-            8,
-            [
-             ('a', 1/5),
-             ('i', 1/5),
-             ('e', 1/5),
-             ('u', 1/5),
-             ('o', 1/5)],
-            1
-        )
-
-        hmm.add_transition(
-            8,
-            7,
-            [
-             ('p', 1/7),
-             ('t', 1/7),
-             ('k', 1/7),
-             ('b', 1/7),
-             ('d', 1/7),
-             ('g', 1/7),
-             ('r', 1/7)],
-            2/3
-        )
-        hmm.add_transition(
-            8,
-            END,
-            [('', 1)],
-            1/3
-        )
-
+        level_hmm = compiled_hmm.with_parameters(noise=noise_level)
         for j in range(corpora_per_level):
-            print('Generating corpus number {}...'.format(j))
-            stringset = hmm.generate_stringset(corpus_size)
-            
             outfile = join(
-                outdir, 'noisy_parupa_{}_{}.txt'.format(
-                    int(noise_level * 100), j
+                outdir, 'noisy_{}_{}_{}.txt'.format(
+                    hmm.name, int(noise_level * 100), j
                 )
             )
-            with open(outfile, 'w') as f:
-                for word in stringset:
-                    print(' '.join(word), file=f)
+            tasks.append((level_hmm, corpus_size, outfile, next(streams)))
+
+    for _, outfile, error in batch.run_batch(generate_task, tasks, jobs=jobs):
+        if error is not None:
+            raise error
+        print('Generated {}'.format(outfile))
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -231,9 +118,26 @@ if __name__ == '__main__':
         '--outdir', type=str, default=DEFAULT_OUTDIR,
         help='The directory to save output corpora in.'
     )
+    parser.add_argument(
+        '--seed', type=int, default=None,
+        help='Seeds the random number generators, so the same seed and '
+             'arguments always produce the same corpora. If not given, a '
+             'random seed is used and printed.'
+    )
+    parser.add_argument(
+        '--jobs', type=int, default=DEFAULT_JOBS,
+        help='The number of corpora to generate in parallel. 0 uses one '
+             'process per CPU. The corpora are identical regardless of this '
+             'value.'
+    )
+    parser.add_argument(
+        '--spec', type=str, default=DEFAULT_SPEC,
+        help='The JSON file defining the HMM to generate corpora from. Its '
+             'probabilities can depend on a noise parameter.'
+    )
     args = parser.parse_args()
 
     generate_corpora(
         args.noise_levels, args.corpora_per_level, args.corpus_size,
-        args.outdir
+        args.outdir, args.seed, args.jobs, args.spec
     )
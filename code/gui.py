@@ -1,6 +1,7 @@
 import os
 import sys
 import tkinter as tk
+import vector_io
 from clusterer import do_clustering
 from tkinter import messagebox
 from tkinter.filedialog import askopenfilename, askdirectory
@@ -27,7 +28,9 @@ BOOL_LABELS = ["True", "False"]
 FILE_TYPE = (
     ("All Files", "*.*"), 
     ("Text Files", "*.txt"),
-    ("Data Files", "*.data")
+    ("Data Files", "*.data"),
+    ("Binary Data Files", "*.npy"),
+    ("Sparse Data Files", "*.npz")
 )
 COUNT_METHODS = ["ngram"]
 WEIGHT_METHODS = ["ppmi", "probability", "conditional_probability", "pmi", "none"]
@@ -160,9 +163,13 @@ def open_file_name():
     )
     if not filepath:
         return
-    filepath = filepath.rsplit('.', 1)
+    # A value file is loaded as chosen, but any other file of the model
+    # (such as its .sounds file) stands for the model's stem.
+    stem, value_file = vector_io.split_value_file(filepath)
+    if value_file is None:
+        filepath = os.path.splitext(filepath)[0]
     file_name_ent.delete("0", tk.END)
-    file_name_ent.insert(tk.END, filepath[0])
+    file_name_ent.insert(tk.END, filepath)
 
 file_name_ent = tk.Entry(master=clusterer_frame, width=60)
 file_name_ent.grid(row=1, column=1, sticky="w")
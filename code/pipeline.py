@@ -0,0 +1,129 @@
+import argparse
+import clusterer
+import vector_io
+
+from VectorModelBuilder import (
+    DEFAULT_N, NGRAM, NUMPY, PPMI, VectorModelBuilder
+)
+
+'''
+Finds the classes of sounds in a corpus in a single step. The vector model
+built from the corpus is passed straight to the clusterer in memory, rather
+than being saved by VectorModelBuilder.py and read back by clusterer.py.
+'''
+
+def corpus_to_classes(dataset, count_method=NGRAM, weighting=PPMI,
+                      n=DEFAULT_N, sparse=False, backend=NUMPY,
+                      v_scalar=clusterer.DEFAULT_VARIABILITY_SCALAR,
+                      constrain_partition=False,
+                      constrain_pcs=False,
+                      clustering=clusterer.DEFAULT_CLUSTERING,
+                      jobs=clusterer.DEFAULT_JOBS,
+                      pca=clusterer.DEFAULT_PCA,
+                      vector_outdir=None,
+                      fmt=vector_io.BINARY,
+                      hmm=None,
+                      count_tokens=False):
+    '''
+    Counts, weights and clusters a corpus, returning the list of classes
+    found, starting with the class of all sounds. The arguments are those of
+    VectorModelBuilder and clusterer.cluster_vectors.
+
+    vector_outdir: If given, the vector model is also saved to this
+                   directory in the format fmt, named as VectorModelBuilder
+                   would name it.
+    hmm: If given, a CompiledHMM whose expected counts are clustered in
+         place of the counts of the dataset, which is then only used to
+         name the vector model (see VectorModelBuilder.count_hmm).
+    '''
+    builder = VectorModelBuilder(
+        dataset, count_method=count_method, weighting=weighting,
+        outdir=vector_outdir, n=n, sparse=sparse, backend=backend,
+        count_tokens=count_tokens
+    )
+    if hmm is not None:
+        builder.count_hmm(hmm)
+    builder.create_vector_model()
+    if vector_outdir is not None:
+        builder.save_vector_model(fmt)
+
+    return clusterer.cluster_vectors(
+        builder.matrix, builder.sound_idx, v_scalar, constrain_partition,
+        constrain_pcs, clustering, jobs=jobs, pca=pca
+    )
+
+if __name__ == '__main__':
+    # Only needed for --hmm, so importing the pipeline doesn't load it
+    from HMM import load_hmm, parse_parameter
+
+    parser = argparse.ArgumentParser(
+        description='Find phonological classes in a corpus, without saving '
+                    'and reloading its vector embedding.'
+    )
+    parser.add_argument(
+        'dataset', type=str, help='The corpus to find classes in.'
+    )
+    parser.add_argument(
+        'output_file', type=str,
+        help='Path to where the discovered classes will be saved.'
+    )
+    parser.add_argument(
+        '--count_method', default=NGRAM, type=str,
+        help='The method to use when creating the context matrix.'
+    )
+    parser.add_argument(
+        '--n', default=DEFAULT_N, type=int,
+        help='If count_method is "ngram", this specifies n.'
+    )
+    parser.add_argument(
+        '--weighting', default=PPMI, type=str,
+        help='The method to weight the raw counts.'
+    )
+    parser.add_argument(
+        '--sparse', action='store_true',
+        help='Store the count and weighted matrices as sparse matrices.'
+    )
+    parser.add_argument(
+        '--backend', type=str, default=NUMPY,
+        help='The implementation used to count n-grams: "numpy" or "nltk".'
+    )
+    parser.add_argument(
+        '--count_tokens', action='store_true',
+        help='Count every occurrence of each word in the corpus, rather than '
+             'each distinct word once.'
+    )
+    clusterer.add_clustering_arguments(parser)
+    parser.add_argument(
+        '--save_vectors', type=str, default=None,
+        help='If given, the vector embedding is also saved to this directory.'
+    )
+    parser.add_argument(
+        '--format', type=str, default=vector_io.BINARY,
+        help='The format to save the vector embedding in if --save_vectors '
+             'is given: "binary" or "text".'
+    )
+    parser.add_argument(
+        '--hmm', type=str, default=None,
+        help='A JSON file specifying an HMM (see HMM.load_hmm). The expected '
+             'counts of the strings it generates are clustered instead of '
+             'the counts of the dataset, which is then only used to name the '
+             'saved vector embedding.'
+    )
+    parser.add_argument(
+        '--hmm_parameters', type=parse_parameter, nargs='+', default=[],
+        metavar='NAME=VALUE',
+        help='Values of the parameters of the HMM given by --hmm, such as '
+             'noise=0.25.'
+    )
+
+    args = parser.parse_args()
+    hmm = None
+    if args.hmm:
+        hmm = load_hmm(args.hmm).compile(**dict(args.hmm_parameters))
+    classes = corpus_to_classes(
+        args.dataset, args.count_method, args.weighting, args.n, args.sparse,
+        args.backend, args.v_scalar, args.no_constrain_initial_partition,
+        args.no_constrain_initial_pcs, args.clustering, args.jobs, args.pca,
+        args.save_vectors, args.format, hmm, args.count_tokens
+    )
+    clusterer.save_classes(classes, args.output_file)
@@ -0,0 +1,193 @@
+from collections import namedtuple
+from glob import glob
+from math import exp, log, pi
+from os.path import basename, dirname, join
+
+import clusterer
+import numpy as np
+import pytest
+import vector_io
+
+'''
+Tests that the batched BIC in clusterer.compute_bics gives the same scores,
+and so chooses the same number of clusters, as the original implementation,
+which scored one clustering at a time with a loop over the points. That
+implementation is kept below as the reference.
+'''
+
+ROOT = join(dirname(__file__), '..')
+SHIPPED_MODELS = sorted(
+    f[:-len(vector_io.TEXT_EXT)]
+    for f in glob(join(ROOT, 'vector_data', '*' + vector_io.TEXT_EXT))
+)
+
+# The most clusters tried on each principal component
+MAX_CLUSTERS = 5
+
+# Stands in for a fitted KMeans, which is all compute_bic reads
+FittedClustering = namedtuple('FittedClustering', ['labels_', 'n_clusters'])
+
+def calculate_mean_and_variance(X, n):
+    '''
+    Calculate the mean and variance of a cluster
+    '''
+    my_sum = 0
+    sumsq = 0
+
+    sorted_X = sorted(X)
+
+    median = sorted_X[len(sorted_X) // 2]
+    for item in sorted_X:
+        my_sum += item - median
+        sumsq += (item - median) * (item - median)
+    mean = my_sum / n + median
+
+    if n > 1:
+        variance = (sumsq - my_sum * my_sum / n) / (n - 1)
+    else:
+        variance = 0
+
+    return mean, variance
+
+def reference_bic(kmeans, X):
+    '''
+    The original compute_bic, before it was batched.
+    '''
+    labels = kmeans.labels_
+    # number of clusters
+    m = kmeans.n_clusters
+    # size of the clusters
+    n = np.bincount(labels)
+
+    if len(n) != m:
+        # We've got a cluster with 0 elements in it. This rarely happens, but
+        # should result in infinite BIC.
+        return -np.inf
+
+    lamb = []
+    coeff = []
+    means = []
+    sigmas = []
+
+    for k in range(m):
+        lamb.append(n[k] / len(labels))
+        mean, variance = calculate_mean_and_variance(
+            X[np.where(labels == k)], n[k]
+        )
+        means.append(mean)
+        sigmas.append(variance)
+
+        # If we can't calculate variance within cluster, use minimum distance
+        # to point in other cluster.
+        if variance == 0 or n[k] == 1:
+            X_sorted = np.copy(X).reshape(1, -1)[0]
+            X_sorted.sort()
+            left = min(np.where(X_sorted == means[k])[0]) - 1
+            right = max(np.where(X_sorted == means[k])[0]) + 1
+
+            if right >= len(X):
+                dmin = X_sorted[left + 1] - X_sorted[left]
+            elif left < 0:
+                dmin = X_sorted[right] - X_sorted[right - 1]
+            else:
+                dmin = min(
+                    X_sorted[left + 1] - X_sorted[left],
+                    X_sorted[right] - X_sorted[right - 1]
+                )
+
+            if variance == 0:
+                sigmas[-1] = dmin * dmin / 4.0 / 9.0
+            if n[k] == 1:
+                sigmas[-1] = dmin * dmin
+
+        coeff.append(lamb[k] / (2.0 * pi * sigmas[-1])**0.5)
+
+    log_likelihood = 0
+    for item in X:
+        likelihood = 0
+        for k in range(m):
+            likelihood += coeff[k] * exp(
+                -(item - means[k]) * (item - means[k]) / (2 * sigmas[k])
+            )
+        log_likelihood += log(likelihood)
+
+    bic = 2 * log_likelihood - (3 * m - 1) * log(len(X))
+    return bic
+
+def assert_same_bics(X, labelings):
+    '''
+    Checks compute_bics and compute_bic against the reference for each
+    clustering of X, and that they choose the same clustering.
+    '''
+    X = np.asarray(X, dtype=float)
+    expected = [
+        reference_bic(FittedClustering(np.asarray(labels), m), X)
+        for labels, m in labelings
+    ]
+    bics = clusterer.compute_bics(X, labelings)
+    np.testing.assert_allclose(bics, expected, rtol=1e-9, atol=1e-9)
+    for (labels, m), bic in zip(labelings, bics):
+        assert clusterer.compute_bic(
+            FittedClustering(np.asarray(labels), m), X
+        ) == bic
+    assert np.argmax(bics) == np.argmax(expected)
+
+def principal_columns(stem):
+    '''
+    Yields each principal component of a shipped model that the clusterer
+    would cluster over, as a 1D array.
+    '''
+    values, _, _ = vector_io.load_vector_model(stem)
+    pca_values, highest_dim = clusterer.principal_components(
+        values, constrain_pcs=False
+    )
+    for i in range(highest_dim):
+        yield pca_values[:, i]
+
+@pytest.mark.parametrize('clustering', [clusterer.DP, clusterer.KMEANS])
+@pytest.mark.parametrize('stem', SHIPPED_MODELS, ids=basename)
+def test_shipped_model_columns(stem, clustering):
+    np.random.seed(0)
+    for col in principal_columns(stem):
+        max_clusters = min(MAX_CLUSTERS, len(col))
+        assert_same_bics(col, clusterer.cluster_1d(col, max_clusters,
+                                                   clustering))
+
+def test_ties():
+    # Values shared across clusters, and clusters whose mean is a tied value
+    X = [0.0, 0.0, 0.0, 1.0, 1.0, 2.0, 2.0, 2.0, 5.0, 5.0]
+    assert_same_bics(X, [
+        ([0] * 10, 1),
+        ([0, 0, 0, 0, 0, 1, 1, 1, 1, 1], 2),
+        ([0, 0, 0, 1, 1, 1, 1, 1, 1, 1], 2),
+        ([0, 0, 0, 1, 1, 1, 1, 1, 2, 2], 3),
+        ([0, 0, 1, 1, 1, 2, 2, 2, 2, 2], 3),
+    ])
+
+def test_singletons():
+    X = [-4.0, 0.1, 0.2, 0.4, 0.5, 9.0]
+    assert_same_bics(X, [
+        ([0, 1, 1, 1, 1, 1], 2),
+        ([0, 0, 0, 0, 0, 1], 2),
+        ([0, 1, 1, 1, 1, 2], 3),
+        ([0, 1, 1, 2, 2, 3], 4),
+        ([0, 1, 2, 3, 4, 5], 6),
+    ])
+
+def test_zero_variance_clusters():
+    X = [1.5, 1.5, 1.5, 3.0, 3.0, 7.25, 7.25, 7.25, 7.25]
+    assert_same_bics(X, [
+        ([0, 0, 0, 1, 1, 1, 1, 1, 1], 2),
+        ([0, 0, 0, 1, 1, 2, 2, 2, 2], 3),
+        ([0, 0, 0, 0, 0, 1, 1, 1, 1], 2),
+    ])
+
+def test_empty_cluster():
+    X = np.array([0.0, 1.0, 2.0, 3.0])
+    labelings = [([0, 0, 1, 1], 2), ([0, 0, 1, 1], 3)]
+    assert list(clusterer.compute_bics(X, labelings)) == [
+        reference_bic(FittedClustering(np.asarray(labels), m), X)
+        for labels, m in labelings
+    ]
+    # The original failed when the empty cluster wasn't the last one
+    assert clusterer.compute_bics(X, [([0, 0, 2, 2], 3)])[0] == -np.inf
@@ -0,0 +1,41 @@
+from contextlib import redirect_stdout
+from os import devnull, listdir
+from os.path import dirname, join
+
+import generate_parupa_corpora
+
+'''
+Tests that seeded corpus generation gives the same corpora however many
+processes generate them.
+'''
+
+SPEC = join(dirname(__file__), generate_parupa_corpora.DEFAULT_SPEC)
+NOISE_LEVELS = [0, 0.5, 1]
+
+def generate(outdir, jobs, seed=1234):
+    with open(devnull, 'w') as f, redirect_stdout(f):
+        generate_parupa_corpora.generate_corpora(
+            NOISE_LEVELS, 2, 500, str(outdir), seed=seed, jobs=jobs, spec=SPEC
+        )
+    return {
+        name: (outdir / name).read_bytes() for name in sorted(listdir(outdir))
+    }
+
+def test_same_corpora_regardless_of_jobs(tmp_path):
+    serial_dir = tmp_path / 'serial'
+    parallel_dir = tmp_path / 'parallel'
+    serial_dir.mkdir()
+    parallel_dir.mkdir()
+
+    serial = generate(serial_dir, jobs=1)
+    assert len(serial) == len(NOISE_LEVELS) * 2
+    assert generate(parallel_dir, jobs=2) == serial
+
+def test_seed_changes_corpora(tmp_path):
+    first_dir = tmp_path / 'first'
+    second_dir = tmp_path / 'second'
+    first_dir.mkdir()
+    second_dir.mkdir()
+
+    assert generate(first_dir, jobs=1) != generate(second_dir, jobs=1,
+                                                   seed=4321)
@@ -0,0 +1,68 @@
+from itertools import product
+
+import clusterer
+import numpy as np
+import pytest
+
+'''
+Tests that the dynamic programming k-means in clusterer.kmeans_1d finds the
+clusterings with the lowest within-cluster sum of squares, by comparing it
+with every possible clustering of small inputs.
+'''
+
+MAX_CLUSTERS = 4
+
+def sum_of_squares(X, labels):
+    return sum(
+        ((X[labels == k] - X[labels == k].mean()) ** 2).sum()
+        for k in np.unique(labels)
+    )
+
+def brute_force(X, k):
+    '''
+    Returns the lowest within-cluster sum of squares of any clustering of X
+    into exactly k non-empty clusters.
+    '''
+    return min(
+        sum_of_squares(X, np.array(labels))
+        for labels in product(range(k), repeat=len(X))
+        if len(set(labels)) == k
+    )
+
+def random_inputs(seed):
+    rng = np.random.default_rng(seed)
+    size = rng.integers(1, 8)
+    # Half of the inputs are drawn from a few values, so they have ties
+    if seed % 2:
+        return rng.integers(0, 3, size).astype(float)
+    return rng.normal(size=size)
+
+@pytest.mark.parametrize('seed', range(40))
+def test_optimal_sum_of_squares(seed):
+    X = random_inputs(seed)
+    labelings = clusterer.kmeans_1d(X, MAX_CLUSTERS)
+    assert len(labelings) == min(MAX_CLUSTERS, len(X))
+    for k, labels in enumerate(labelings, 1):
+        # Every cluster is non-empty, and they're numbered left to right
+        assert sorted(set(labels)) == list(range(k))
+        assert list(labels[np.argsort(X, kind='stable')]) == sorted(labels)
+        assert sum_of_squares(X, labels) == pytest.approx(
+            brute_force(X, k), abs=1e-9
+        )
+
+def test_all_tied():
+    X = np.full(5, 2.5)
+    for k, labels in enumerate(clusterer.kmeans_1d(X, MAX_CLUSTERS), 1):
+        assert sorted(set(labels)) == list(range(k))
+        assert sum_of_squares(X, labels) == 0
+
+def test_cluster_1d_matches_kmeans_1d():
+    X = np.array([3.0, -1.0, 0.5, 7.0, 7.5, -1.0])
+    labelings = clusterer.cluster_1d(X, 3, clusterer.DP)
+    assert [k for _, k in labelings] == [1, 2, 3]
+    for (labels, _), expected in zip(labelings, clusterer.kmeans_1d(X, 3)):
+        assert list(labels) == list(expected)
+
+def test_cluster_1d_rejects_unknown_method():
+    with pytest.raises(ValueError, match='not a valid clustering method'):
+        clusterer.cluster_1d(np.arange(4.0), 2, 'hierarchical')
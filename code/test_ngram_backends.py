@@ -0,0 +1,79 @@
+from contextlib import redirect_stdout
+from os import devnull
+from os.path import dirname, join
+from scipy import sparse
+
+import numpy as np
+import pytest
+import VectorModelBuilder
+
+'''
+Tests that the vectorized numpy n-gram counts match the nltk backend, which
+is kept to verify them, and that counting several values of n from a shared
+encoding matches counting each of them on its own.
+'''
+
+CORPORA = [
+    join(dirname(__file__), '..', 'corpora', name + '.txt')
+    for name in ['parupa', 'samoan']
+]
+NS = [1, 2, 3, 4]
+
+def count(corpus, **kwargs):
+    '''
+    Returns a builder with the counts of a corpus calculated.
+    '''
+    with open(devnull, 'w') as f, redirect_stdout(f):
+        builder = VectorModelBuilder.VectorModelBuilder(corpus, **kwargs)
+        builder.build_matrix()
+    return builder
+
+def assert_same_counts(builder, expected):
+    assert builder.sound_idx == expected.sound_idx
+    assert list(builder.context_idx) == list(expected.context_idx)
+    matrix, expected_matrix = builder.count_matrix, expected.count_matrix
+    if sparse.issparse(matrix):
+        matrix = matrix.toarray()
+    if sparse.issparse(expected_matrix):
+        expected_matrix = expected_matrix.toarray()
+    np.testing.assert_array_equal(matrix, expected_matrix)
+
+@pytest.mark.parametrize('count_tokens', [False, True])
+@pytest.mark.parametrize('n', NS)
+@pytest.mark.parametrize('corpus', CORPORA)
+def test_numpy_matches_nltk(corpus, n, count_tokens):
+    pytest.importorskip('nltk')
+    assert_same_counts(
+        count(corpus, n=n, backend=VectorModelBuilder.NUMPY,
+              count_tokens=count_tokens),
+        count(corpus, n=n, backend=VectorModelBuilder.NLTK,
+              count_tokens=count_tokens)
+    )
+
+@pytest.mark.parametrize('ns', [[2, 4, 1, 3], [4, 3, 2, 1]])
+@pytest.mark.parametrize('count_tokens', [False, True])
+@pytest.mark.parametrize('corpus', CORPORA)
+def test_multi_n_builders(corpus, count_tokens, ns, monkeypatch):
+    encodings = []
+    encode_corpus = VectorModelBuilder.VectorModelBuilder.encode_corpus
+    def counted_encode_corpus(builder):
+        encodings.append(builder.n)
+        return encode_corpus(builder)
+    monkeypatch.setattr(
+        VectorModelBuilder.VectorModelBuilder, 'encode_corpus',
+        counted_encode_corpus
+    )
+
+    with open(devnull, 'w') as f, redirect_stdout(f):
+        builders = VectorModelBuilder.create_multi_n_builders(
+            corpus, ns, count_tokens=count_tokens
+        )
+    # The corpus is only encoded once, whatever the order of ns
+    assert encodings == [max(ns)]
+    monkeypatch.undo()
+
+    assert [builder.n for builder in builders] == ns
+    for builder in builders:
+        assert_same_counts(
+            builder, count(corpus, n=builder.n, count_tokens=count_tokens)
+        )
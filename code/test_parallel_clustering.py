@@ -0,0 +1,42 @@
+from os.path import dirname, join
+
+import clusterer
+import pytest
+import vector_io
+
+'''
+Tests that clustering independent subsets in parallel finds the same
+classes, in the same order, and the same cache statistics as clustering
+them serially.
+'''
+
+MODELS = [
+    join(dirname(__file__), '..', 'vector_data', name + '_trigram_ppmi')
+    for name in ['parupa', 'samoan']
+]
+
+def cluster(values, sounds, jobs, constrain, cache=None):
+    cache = cache if cache is not None else clusterer.PartitionCache()
+    classes = clusterer.cluster_vectors(
+        values, sounds, constrain_partition=constrain,
+        constrain_pcs=constrain, cache=cache, jobs=jobs
+    )
+    return classes, (len(cache), cache.hits, cache.misses)
+
+@pytest.mark.parametrize('constrain', [True, False])
+@pytest.mark.parametrize('stem', MODELS)
+def test_same_classes_regardless_of_jobs(stem, constrain):
+    values, sounds, _ = vector_io.load_vector_model(stem)
+    serial = cluster(values, sounds, 1, constrain)
+    assert cluster(values, sounds, 2, constrain) == serial
+
+@pytest.mark.parametrize('stem', MODELS)
+def test_same_statistics_with_shared_cache(stem):
+    values, sounds, _ = vector_io.load_vector_model(stem)
+    results = []
+    for jobs in [1, 2]:
+        # The second call reuses the subsets clustered by the first
+        cache = clusterer.PartitionCache()
+        cluster(values, sounds, jobs, True, cache)
+        results.append(cluster(values, sounds, jobs, False, cache))
+    assert results[0] == results[1]
@@ -0,0 +1,54 @@
+from os import utime
+
+import numpy as np
+import pytest
+import vector_io
+
+'''
+Tests that a vector model saved in more than one format loads the most
+recently modified file of vectors by its stem, and any of them by its path.
+'''
+
+SOUNDS = ['a', 'b']
+CONTEXTS = ['x', 'y', 'z']
+
+@pytest.fixture
+def stem(tmp_path):
+    '''
+    Saves a model to text, and a different one to binary five seconds later.
+    '''
+    stem = str(tmp_path / 'model')
+    vector_io.save_vector_model(
+        stem, np.zeros((2, 3)), SOUNDS, CONTEXTS, vector_io.TEXT
+    )
+    vector_io.save_vector_model(
+        stem, np.ones((2, 3)), SOUNDS, CONTEXTS, vector_io.BINARY
+    )
+    utime(stem + vector_io.TEXT_EXT, (0, 0))
+    utime(stem + vector_io.DENSE_EXT, (5, 5))
+    return stem
+
+def test_stem_loads_newest(stem):
+    matrix, sounds, contexts = vector_io.load_vector_model(stem)
+    assert (matrix == 1).all()
+    assert (sounds, contexts) == (SOUNDS, CONTEXTS)
+
+@pytest.mark.parametrize('ext, value', [
+    (vector_io.TEXT_EXT, 0), (vector_io.DENSE_EXT, 1)
+])
+def test_value_file_loads_that_file(stem, ext, value):
+    matrix, sounds, contexts = vector_io.load_vector_model(stem + ext)
+    assert (matrix == value).all()
+    assert (sounds, contexts) == (SOUNDS, CONTEXTS)
+
+def test_missing_value_file(stem):
+    with pytest.raises(IOError):
+        vector_io.load_vector_model(stem + vector_io.SPARSE_EXT)
+
+def test_split_value_file():
+    assert vector_io.split_value_file('dir/model.npz') == (
+        'dir/model', 'dir/model.npz'
+    )
+    assert vector_io.split_value_file('dir/noisy_0.5') == (
+        'dir/noisy_0.5', None
+    )
@@ -0,0 +1,55 @@
+from contextlib import redirect_stdout
+from glob import glob
+from os import devnull
+from os.path import basename, dirname, join
+from scipy import sparse
+
+import numpy as np
+import pytest
+import vector_io
+import VectorModelBuilder
+
+'''
+Regression tests for the weighting of vector models. The trigram PPMI model
+of each shipped corpus is rebuilt and compared with the model shipped in
+vector_data, which was saved to text with six decimal places.
+'''
+
+ROOT = join(dirname(__file__), '..')
+MODEL_SUFFIX = '_trigram_ppmi'
+
+# Values are saved with '%f', so they are only within half of 1e-6
+TOLERANCE = 5e-7 + 1e-12
+
+SHIPPED_MODELS = sorted(
+    basename(f)[:-len(MODEL_SUFFIX + vector_io.TEXT_EXT)]
+    for f in glob(join(ROOT, 'vector_data', '*' + MODEL_SUFFIX
+                       + vector_io.TEXT_EXT))
+)
+
+@pytest.mark.parametrize('sparse_matrix', [False, True])
+@pytest.mark.parametrize('name', SHIPPED_MODELS)
+def test_trigram_ppmi_matches_shipped_model(name, sparse_matrix):
+    expected, sounds, contexts = vector_io.load_vector_model(
+        join(ROOT, 'vector_data', name + MODEL_SUFFIX)
+    )
+    with open(devnull, 'w') as f, redirect_stdout(f):
+        builder = VectorModelBuilder.VectorModelBuilder(
+            join(ROOT, 'corpora', name + '.txt'), n=3,
+            weighting=VectorModelBuilder.PPMI, sparse=sparse_matrix
+        )
+        builder.create_vector_model()
+    matrix = builder.matrix
+    if sparse.issparse(matrix):
+        matrix = matrix.toarray()
+
+    # Rows and columns are matched by label, so the test doesn't depend on
+    # the order the sounds and contexts were first seen in
+    assert sorted(builder.sound_idx) == sorted(sounds)
+    assert sorted(builder.context_idx) == sorted(contexts)
+    rows = [list(builder.sound_idx).index(sound) for sound in sounds]
+    context_idx = {context: j for j, context in enumerate(builder.context_idx)}
+    columns = [context_idx[context] for context in contexts]
+    np.testing.assert_allclose(
+        matrix[np.ix_(rows, columns)], expected, rtol=0, atol=TOLERANCE
+    )
@@ -0,0 +1,171 @@
+import argparse
+import numpy as np
+
+from os import path, remove, walk
+from scipy import sparse
+
+'''
+Functions for saving and loading vector models, and a script that converts
+existing vector models between the binary and text formats.
+
+A vector model with stem <stem> consists of a file of numeric vectors, a
+<stem>.sounds file with the sound labels (row names) and a <stem>.contexts
+file with the context labels (column names). The vectors are stored in one
+of three ways:
+
+* <stem>.npy: a dense binary numpy array, which can be memory mapped.
+* <stem>.npz: a sparse binary scipy.sparse matrix.
+* <stem>.data: a dense text matrix, as written by np.savetxt. This is the
+  legacy format, and is still needed by plot_embedding.R.
+'''
+
+DENSE_EXT = '.npy'
+SPARSE_EXT = '.npz'
+TEXT_EXT = '.data'
+SOUND_EXT = '.sounds'
+CONTEXT_EXT = '.contexts'
+
+# Vector model formats
+BINARY = 'binary'
+TEXT = 'text'
+
+# The extensions of the files a vector model's vectors can be stored in
+VALUE_EXTS = (DENSE_EXT, SPARSE_EXT, TEXT_EXT)
+
+DEFAULT_DIR = '../vector_data/'
+
+def split_value_file(stem):
+    '''
+    Splits the path of a vector model's value file, such as
+    parupa_trigram_ppmi.npy, into the stem of the model and the path.
+    Returns (stem, None) for a path that doesn't name a value file.
+    '''
+    base, ext = path.splitext(stem)
+    if ext in VALUE_EXTS:
+        return base, stem
+    return stem, None
+
+def value_files(stem):
+    '''
+    Returns the files holding the numeric vectors of the vector model with
+    the given stem, ordered from most to least recently modified.
+    '''
+    candidates = [
+        stem + ext for ext in VALUE_EXTS if path.isfile(stem + ext)
+    ]
+    return sorted(candidates, key=path.getmtime, reverse=True)
+
+def save_vector_model(stem, matrix, sounds, contexts, fmt=BINARY):
+    '''
+    Saves a vector model under the given stem.
+
+    matrix: A dense numpy array or scipy.sparse matrix of vectors.
+    sounds: A list of sound labels, one per row.
+    contexts: A list of context labels, one per column.
+    fmt: 'binary' saves dense matrices to .npy and sparse matrices to .npz.
+         'text' saves the matrix to .data, densifying it if necessary.
+    '''
+    if fmt == BINARY:
+        if sparse.issparse(matrix):
+            sparse.save_npz(stem + SPARSE_EXT, matrix.tocsr())
+        else:
+            np.save(stem + DENSE_EXT, np.asarray(matrix, dtype=float))
+    elif fmt == TEXT:
+        if sparse.issparse(matrix):
+            matrix = matrix.toarray()
+        np.savetxt(stem + TEXT_EXT, matrix, fmt='%f')
+    else:
+        raise ValueError(
+            "'{}' is not a valid vector model format. Available formats "
+            "are: {}".format(fmt, ','.join([BINARY, TEXT]))
+        )
+
+    with open(stem + SOUND_EXT, 'w') as f:
+        print(' '.join(sounds), file=f)
+    with open(stem + CONTEXT_EXT, 'w') as f:
+        print(' '.join(contexts), file=f)
+
+def load_vector_model(stem, mmap=True):
+    '''
+    Loads the vector model with the given stem, returning a tuple of
+    (matrix, sounds, contexts). The format is detected automatically; if
+    the vectors have been saved in more than one format, the most recently
+    modified file is used, unless stem is the path of one of the value
+    files, such as <stem>.npy, in which case that file is used.
+
+    mmap: If True, .npy files are memory mapped rather than read into memory.
+    '''
+    stem, value_file = split_value_file(stem)
+    if value_file is None:
+        candidates = value_files(stem)
+        if not candidates:
+            raise IOError(
+                "No vector model found with stem '{}'. Expected one of {}, {} "
+                "or {}.".format(stem, DENSE_EXT, SPARSE_EXT, TEXT_EXT)
+            )
+        value_file = candidates[0]
+    elif not path.isfile(value_file):
+        raise IOError("No vector model file found at '{}'.".format(value_file))
+
+    if value_file.endswith(DENSE_EXT):
+        matrix = np.load(value_file, mmap_mode='r' if mmap else None)
+    elif value_file.endswith(SPARSE_EXT):
+        matrix = sparse.load_npz(value_file).tocsr()
+    else:
+        matrix = np.loadtxt(value_file)
+
+    with open(stem + SOUND_EXT, 'r') as sound_file:
+        sounds = sound_file.read().strip().split(' ')
+    with open(stem + CONTEXT_EXT, 'r') as context_file:
+        contexts = context_file.read().strip().split(' ')
+
+    # A model with a single sound or context is read back as a 1D array.
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(len(sounds), len(contexts))
+
+    return matrix, sounds, contexts
+
+def convert_dir(directory, fmt=BINARY, remove_old=False):
+    '''
+    Converts every vector model found in a directory and its subdirectories
+    to the given format. Returns the stems of the converted models.
+
+    remove_old: If True, the files in the old format are deleted.
+    '''
+    old_ext = TEXT_EXT if fmt == BINARY else DENSE_EXT
+    converted = []
+    for dirpath, _, filenames in walk(directory):
+        for filename in sorted(filenames):
+            if not filename.endswith(old_ext):
+                continue
+            stem = path.join(dirpath, filename[:-len(old_ext)])
+            print('Converting {}...'.format(stem))
+            matrix, sounds, contexts = load_vector_model(stem, mmap=False)
+            save_vector_model(stem, matrix, sounds, contexts, fmt)
+            if remove_old:
+                remove(stem + old_ext)
+            converted.append(stem)
+    return converted
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Convert the vector models in a directory between the '
+                    'binary and text formats.'
+    )
+    parser.add_argument(
+        'directory', type=str, nargs='?', default=DEFAULT_DIR,
+        help='The directory of vector models to convert. Subdirectories are '
+             'converted as well.'
+    )
+    parser.add_argument(
+        '--to', type=str, default=BINARY,
+        help='The format to convert to: "binary" converts .data files to '
+             '.npy files, and "text" converts .npy files to .data files.'
+    )
+    parser.add_argument(
+        '--remove_old', action='store_true',
+        help='Delete the files in the old format after converting them.'
+    )
+
+    args = parser.parse_args()
+    convert_dir(args.directory, args.to, args.remove_old)
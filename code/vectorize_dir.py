@@ -1,8 +1,14 @@
 import argparse
+import batch
+import hashlib
+import json
 import VectorModelBuilder
+import sys
+import time
+import vector_io
 
-from os import listdir
-from os.path import isfile, join
+from os import listdir, replace
+from os.path import basename, isfile, join
 
 '''
 Convenience script that produces a vector representation of all files in a
@@ -11,17 +17,135 @@ folder.
 
 DEFAULT_INDIR = '../corpora/noisy_parupa/'
 DEFAULT_OUTDIR = '../vector_data/noisy_parupa/'
+DEFAULT_JOBS = 1
 
-def vectorize_dir(indir, outdir, count_method, weighting, n):
+# Records the corpus and parameters each vector model in outdir was built from
+MANIFEST_FILE = 'vectorize_manifest.json'
+
+def file_hash(filename):
+    '''
+    Returns the SHA-256 hex digest of the contents of a file.
+    '''
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_manifest(outdir):
+    '''
+    Loads the manifest of vector models in outdir, which maps the stem of
+    each model to the corpus hash and builder parameters it was built with.
+    '''
+    manifest_path = join(outdir, MANIFEST_FILE)
+    if not isfile(manifest_path):
+        return {}
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+def save_manifest(outdir, manifest):
+    '''
+    Saves the manifest of vector models in outdir. The manifest is written to
+    a temporary file first so an interrupted run can't corrupt it.
+    '''
+    manifest_path = join(outdir, MANIFEST_FILE)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    replace(manifest_path + '.tmp', manifest_path)
+
+def vectorize_file(full_path, outdir, count_method, weighting, n,
+                   sparse=False, fmt=vector_io.BINARY, count_tokens=False):
+    '''
+    Produces and saves the vector representation of a single corpus file.
+    Returns the time taken in seconds.
+    '''
+    start = time.time()
+    builder = VectorModelBuilder.VectorModelBuilder(
+        full_path, count_method=count_method, weighting=weighting,
+        outdir=outdir, n=n, sparse=sparse, count_tokens=count_tokens
+    )
+    builder.create_vector_model()
+    builder.save_vector_model(fmt)
+    return time.time() - start
+
+def vectorize_dir(indir, outdir, count_method, weighting, n, sparse=False,
+                  fmt=vector_io.BINARY, jobs=DEFAULT_JOBS, force=False,
+                  count_tokens=False):
+    '''
+    Vectorizes every file in indir. Output files are named exactly as they
+    would be by VectorModelBuilder, however many jobs are used.
+
+    jobs: The number of corpora to vectorize in parallel, each in its own
+          process. 0 uses one process per CPU.
+    force: If False, corpora whose contents and builder parameters are
+           unchanged since their vector model was last built in outdir are
+           skipped. If True, every corpus is rebuilt.
+    count_tokens: If True, every occurrence of each word is counted rather
+                  than each distinct word once.
+
+    A corpus that fails to vectorize is reported and skipped, rather than
+    stopping the whole batch. Returns a list of (filename, error) tuples for
+    the corpora that failed.
+    '''
     corpora = sorted([f for f in listdir(indir) if isfile(join(indir, f))])
+    builder_args = (
+        outdir, count_method, weighting, n, sparse, fmt, count_tokens
+    )
+    params = {
+        'count_method': count_method, 'weighting': weighting, 'n': n,
+        'sparse': sparse, 'format': fmt
+    }
+    manifest = load_manifest(outdir)
+    failures = []
+    start = time.time()
+
+    # Work out which corpora have changed since they were last vectorized
+    pending = {}
     for f in corpora:
         full_path = join(indir, f)
-        builder = VectorModelBuilder.VectorModelBuilder(
-            full_path, count_method=count_method, weighting=weighting, 
-            outdir=outdir, n=n
+        stem = VectorModelBuilder.model_name(
+            full_path, count_method, n, weighting, count_tokens
         )
-        builder.create_vector_model()
-        builder.save_vector_model()
+        entry = dict(params, corpus=f, hash=file_hash(full_path))
+        if (not force and manifest.get(stem) == entry
+                and vector_io.value_files(join(outdir, stem))):
+            print('{} is unchanged, skipping'.format(f))
+        else:
+            pending[full_path] = (stem, entry)
+
+    results = batch.run_batch(
+        vectorize_file, sorted(pending), builder_args, jobs
+    )
+    for done, (full_path, elapsed, error) in enumerate(results, 1):
+        f = basename(full_path)
+        stem, entry = pending[full_path]
+        if error is None:
+            print('[{}/{}] {} done in {:.2f}s'.format(
+                done, len(pending), f, elapsed
+            ))
+            manifest[stem] = entry
+        else:
+            print('[{}/{}] {} FAILED: {!r}'.format(
+                done, len(pending), f, error
+            ), file=sys.stderr)
+            failures.append((f, error))
+            manifest.pop(stem, None)
+    save_manifest(outdir, manifest)
+
+    print('Vectorized {} of {} corpora in {:.2f}s ({} unchanged)'.format(
+        len(pending) - len(failures), len(pending), time.time() - start,
+        len(corpora) - len(pending)
+    ))
+    for f, error in sorted(failures, key=lambda failure: failure[0]):
+        print('Failed: {} ({!r})'.format(f, error), file=sys.stderr)
+
+    # Report outputs whose corpus is no longer in indir
+    for stem, entry in sorted(manifest.items()):
+        if entry['corpus'] not in corpora:
+            print('Stale: {} was built from {}, which no longer exists'.format(
+                stem, entry['corpus']
+            ))
+    return failures
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -47,6 +171,34 @@ if __name__ == '__main__':
         '--n', type=int, default=VectorModelBuilder.DEFAULT_N,
         help='If count_method is "ngram", this specifies n.'
     )
+    parser.add_argument(
+        '--sparse', action='store_true',
+        help='Store the vector models as sparse matrices.'
+    )
+    parser.add_argument(
+        '--format', type=str, default=vector_io.BINARY,
+        help='The format to save the vectors in: "binary" or "text".'
+    )
+    parser.add_argument(
+        '--jobs', type=int, default=DEFAULT_JOBS,
+        help='The number of corpora to vectorize in parallel. 0 uses one '
+             'process per CPU.'
+    )
+    parser.add_argument(
+        '--count_tokens', action='store_true',
+        help='Count every occurrence of each word in a corpus, rather than '
+             'each distinct word once.'
+    )
+    parser.add_argument(
+        '--force', action='store_true',
+        help='Rebuild every vector model, even if its corpus and parameters '
+             'are unchanged since it was last built.'
+    )
 
     args = parser.parse_args()
-    vectorize_dir(args.indir, args.outdir, args.count_method, args.weighting, args.n)
+    failures = vectorize_dir(
+        args.indir, args.outdir, args.count_method, args.weighting, args.n,
+        args.sparse, args.format, args.jobs, args.force, args.count_tokens
+    )
+    if failures:
+        sys.exit(1)